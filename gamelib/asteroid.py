@@ -1,74 +1,409 @@
 import random
+from collections import namedtuple
 
+import numpy as np
 from panda3d import core
-from direct.interval.LerpInterval import *
-
-from .planet import GROWTH_TIME
 
 SCALE_DURATION = 0.3
+SPAWN_SCALE = 1e-3
+
+ORBIT_MIN_TIME = 8.0
+ORBIT_MAX_TIME = 12.0
+SPIN_TIME = 3.0
+
+# Time between two asteroid spawns
+SPAWN_TIME = 1.5
+
+# Asteroids that cannot be seen only have their nodes updated once every this
+# many frames
+SLEEP_INTERVAL = 8
+
+
+# Everything that is random about a newly spawned asteroid
+# The spawn_time is the simulation time that the orbit starts at, or None for
+# the current time of the field
+SpawnPlan = namedtuple('SpawnPlan', ['mesh_index', 'hpr', 'xoff', 'yoff', 'orbit_time', 'spawn_time'],
+                       defaults=[None])
+
+
+def orbit_distance(orbit_size, xoff):
+    """Returns the z offset of an asteroid from the center of its orbit."""
+    return -orbit_size * 4.2 - xoff
+
+
+def orbit_positions(offset, orientation, orbit, orbit_size):
+    """Returns the asteroid centers relative to the planet root, given the
+    (N, 2) orbit offsets, (N, 3, 3) root orientations and orbit angles in
+    radians."""
+    xoff = offset[:, 0]
+    yoff = offset[:, 1]
+    zoff = orbit_distance(orbit_size, xoff)
+
+    # Orbit is a pitch of the rotation node, then the root orientation
+    cos_o = np.cos(orbit)
+    sin_o = np.sin(orbit)
+    local = np.stack([
+        xoff,
+        yoff * cos_o - zoff * sin_o,
+        yoff * sin_o + zoff * cos_o,
+    ], axis=-1)
+    return np.einsum('ni,nij->nj', local, orientation)
+
+
+def spawn_scales(age):
+    """Returns the scale of asteroids of the given ages, which ramps up from
+    SPAWN_SCALE over SCALE_DURATION seconds."""
+    ratio = np.minimum(age / SCALE_DURATION, 1.0)
+    # Same curve as the easeIn blend type of intervals
+    return SPAWN_SCALE + (1 - SPAWN_SCALE) * (3 - ratio) * ratio * ratio * 0.5
+
+
+class SpawnScheduler:
+    """
+    Decides when asteroids spawn and what they look like.  All of it is drawn
+    from its own random stream, one plan at a time, and spawn times follow the
+    simulation time rather than the frame time, so that the same seed always
+    produces the same sequence of asteroids.
+    """
+    def __init__(self, seed, mesh_count):
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.mesh_count = mesh_count
+        self.time = 0.0
+        self.next_spawn_time = SPAWN_TIME
+        self.next_plan = self._make_plan()
+
+    def _make_plan(self):
+        rand = self.random
+        return SpawnPlan(
+            mesh_index=rand.randrange(self.mesh_count),
+            hpr=(rand.randrange(360), rand.randrange(-90, 90), 0),
+            xoff=rand.uniform(2, 6),
+            yoff=rand.uniform(2, 6),
+            orbit_time=rand.uniform(ORBIT_MIN_TIME, ORBIT_MAX_TIME),
+        )
+
+    def take_plan(self):
+        """Returns the next plan in the sequence, regardless of time."""
+        plan = self.next_plan
+        self.next_plan = self._make_plan()
+        return plan
+
+    def update(self, dt, count, max_count):
+        """Advances the simulation time, and returns the plan for an asteroid
+        to spawn now, if it is time for one and there is room for it."""
+        self.time += dt
+        plan = None
+        # Stay on the schedule no matter how the frames fall, spawn times that
+        # pass while the field is full are skipped
+        while self.next_spawn_time <= self.time:
+            spawn_time = self.next_spawn_time
+            self.next_spawn_time += SPAWN_TIME
+            if plan is None and count < max_count:
+                plan = self.take_plan()._replace(spawn_time=spawn_time)
+        return plan
+
+
+class AsteroidField:
+    """
+    Advances the orbits of all asteroids at once.  The orbit and spin of each
+    asteroid is a function of the time since it was spawned, which is
+    evaluated for the whole field in one go and then written out to the nodes.
+
+    Only the asteroids that are in view get their nodes updated every frame,
+    the others are asleep and take turns being updated every SLEEP_INTERVAL
+    frames.  Since the orbits are computed from time, they are right again as
+    soon as an asteroid wakes up.
+    """
+    def __init__(self, planet):
+        self.planet = planet
+        self.time = 0.0
+        self.frame = 0
+        self.asteroids = []
+
+        # Per-asteroid state, one row per asteroid in self.asteroids
+        self._spawn_time = np.zeros(0)
+        self._orbit_speed = np.zeros(0)
+        self._offset = np.zeros((0, 2))
+        self._radius = np.zeros(0)
+        self._orientation = np.zeros((0, 3, 3))
+        self._orbit_size = planet.orbit_size
+
+        # Which asteroids were visible last frame, they get one more update
+        # after going out of view so that they do not freeze half on screen
+        self._was_visible = np.zeros(0, dtype=bool)
+
+        # Results of the last update
+        self.positions = np.zeros((0, 3))
+        self.scales = np.zeros(0)
+        self.drawn = 0
+        self.culled = 0
+        self.awake = 0
+        self.asleep = 0
+        self._drawn_pstat = core.PStatCollector('Asteroids:Drawn')
+        self._culled_pstat = core.PStatCollector('Asteroids:Culled')
+        self._awake_pstat = core.PStatCollector('Asteroids:Awake')
+        self._asleep_pstat = core.PStatCollector('Asteroids:Asleep')
+
+    def __len__(self):
+        return len(self.asteroids)
+
+    def add(self, asteroid, orbit_time, spawn_time=None):
+        if spawn_time is None:
+            spawn_time = self.time
+        asteroid.field_index = len(self.asteroids)
+        self.asteroids.append(asteroid)
+        mat = asteroid.root.get_mat()
+        orientation = [tuple(mat.get_row3(i)) for i in range(3)]
+        self._spawn_time = np.append(self._spawn_time, spawn_time)
+        self._orbit_speed = np.append(self._orbit_speed, 360.0 / orbit_time)
+        self._offset = np.append(self._offset, [(asteroid.xoff, asteroid.yoff)], axis=0)
+        self._radius = np.append(self._radius, asteroid.radius)
+        self._orientation = np.append(self._orientation, [orientation], axis=0)
+        self._was_visible = np.append(self._was_visible, True)
+
+        asteroid.rotation.set_p(0)
+        asteroid.asteroid.set_hpr(0, 0, 0)
+        asteroid.asteroid.set_scale(SPAWN_SCALE)
+
+    def remove(self, asteroid):
+        """Stops updating the given asteroid, leaving it where it is."""
+        idx = asteroid.field_index
+        if idx is None:
+            return
+
+        # It may have been asleep, so make sure it is where it should be
+        age = self.time - self._spawn_time[idx]
+        asteroid.rotation.set_p((age * self._orbit_speed[idx]) % 360.0)
+        spin = (age * (360.0 / SPIN_TIME)) % 360.0
+        asteroid.asteroid.set_hpr(spin, spin, 0)
+
+        last = len(self.asteroids) - 1
+        if idx != last:
+            moved = self.asteroids[last]
+            self.asteroids[idx] = moved
+            moved.field_index = idx
+            for arr in (self._spawn_time, self._orbit_speed, self._offset, self._radius, self._orientation, self._was_visible):
+                arr[idx] = arr[last]
+        self.asteroids.pop()
+        self._spawn_time = self._spawn_time[:last]
+        self._orbit_speed = self._orbit_speed[:last]
+        self._offset = self._offset[:last]
+        self._radius = self._radius[:last]
+        self._orientation = self._orientation[:last]
+        self._was_visible = self._was_visible[:last]
+        asteroid.field_index = None
+
+    def update(self, dt):
+        self.time += dt
+        self.frame += 1
+
+        age = self.time - self._spawn_time
+        orbit = (age * self._orbit_speed) % 360.0
+        spin = (age * (360.0 / SPIN_TIME)) % 360.0
+
+        # Only the freshly spawned asteroids are still scaling in
+        self.scales = np.ones(len(age))
+        growing = np.flatnonzero(age < SCALE_DURATION)
+        if len(growing):
+            scale = spawn_scales(age[growing])
+            self.scales[growing] = scale
+            for idx, value in zip(growing.tolist(), scale.tolist()):
+                self.asteroids[idx].asteroid.set_scale(value)
+
+        # The orbits follow the planet as it grows
+        orbit_size = self.planet.orbit_size
+        if orbit_size != self._orbit_size:
+            self._orbit_size = orbit_size
+            zoff = orbit_distance(orbit_size, self._offset[:, 0])
+            for asteroid, z in zip(self.asteroids, zoff.tolist()):
+                asteroid.asteroid.set_z(z)
+
+        self.positions = orbit_positions(self._offset, self._orientation, np.radians(orbit), orbit_size)
+        visible = self._find_visible()
+
+        turn = (np.arange(len(self.asteroids)) + self.frame) % SLEEP_INTERVAL == 0
+        awake = visible | self._was_visible | turn
+        self._was_visible = visible
+        awake = np.flatnonzero(awake)
+        for idx, orbit_p, spin_hp in zip(awake.tolist(), orbit[awake].tolist(), spin[awake].tolist()):
+            asteroid = self.asteroids[idx]
+            asteroid.rotation.set_p(orbit_p)
+            asteroid.asteroid.set_hpr(spin_hp, spin_hp, 0)
+
+        self.awake = len(awake)
+        self.asleep = len(self.asteroids) - self.awake
+        self._awake_pstat.set_level(self.awake)
+        self._asleep_pstat.set_level(self.asleep)
+
+    def get_radii(self):
+        """Returns the current asteroid radii relative to the planet root.  The
+        asteroids are not scaled along with the planet."""
+        return self._radius * self.scales / self.planet.radius
+
+    def hit_test(self, centers, radius):
+        """Returns the asteroids touching any of the spheres with the given
+        centers (relative to the planet root) and radius, nearest first."""
+        if not self.asteroids:
+            return []
+        centers = np.asarray(centers, dtype=float).reshape(-1, 3)
+        deltas = self.positions[None, :, :] - centers[:, None, :]
+        dists = np.sqrt(np.min(np.sum(deltas * deltas, axis=-1), axis=0))
+        hits = np.flatnonzero(dists <= self.get_radii() + radius)
+        hits = hits[np.argsort(dists[hits], kind='stable')]
+        return [self.asteroids[i] for i in hits.tolist()]
+
+    def _find_visible(self):
+        """Returns a mask of the asteroids that can be seen from the camera.
+        The frustum test works the same way as in the cull traversal, which
+        is what the drawn and culled counts are based on, and on top of that
+        asteroids that are hidden behind the planet are not visible either."""
+        if not self.asteroids:
+            self.drawn = self.culled = 0
+            visible = np.zeros(0, dtype=bool)
+        else:
+            radii = self.get_radii()
+            frustum = base.camLens.make_bounds()
+            frustum.xform(base.cam.get_mat(self.planet.root))
+            planes = np.array([tuple(frustum.get_plane(i)) for i in range(frustum.get_num_planes())])
+            planes /= np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
+            dists = self.positions @ planes[:, :3].T + planes[:, 3]
+            in_frustum = np.all(dists <= radii[:, None], axis=1)
+            self.drawn = int(np.count_nonzero(in_frustum))
+            self.culled = len(self.asteroids) - self.drawn
+            visible = in_frustum & ~self._behind_planet(radii)
+        self._drawn_pstat.set_level(self.drawn)
+        self._culled_pstat.set_level(self.culled)
+        return visible
+
+    def _behind_planet(self, radii):
+        """Returns a mask of the asteroids that are fully hidden behind the
+        planet, which is a unit sphere relative to its root."""
+        cam_pos = np.array(tuple(base.cam.get_pos(self.planet.root)))
+        cam_dist = np.linalg.norm(cam_pos)
+        if cam_dist <= 1.0:
+            return np.zeros(len(radii), dtype=bool)
+
+        # Anything that is farther away than the planet center and within the
+        # cone of the planet outline is hidden
+        planet_angle = np.arcsin(1.0 / cam_dist)
+        deltas = self.positions - cam_pos
+        dists = np.linalg.norm(deltas, axis=1)
+        cos_angle = (deltas @ -cam_pos) / (dists * cam_dist)
+        angles = np.arccos(np.clip(cos_angle, -1, 1))
+        sizes = np.arcsin(np.clip(radii / dists, 0, 1))
+        return (dists - radii > cam_dist) & (angles + sizes < planet_angle)
 
 
 class Asteroid:
     MESHES = []
+    MATERIAL = None
+
     def __init__(self, planet, universe):
         self.universe = universe
         self.planet = planet
+        self.field_index = None
 
-        if not self.MESHES:
-            Asteroid.MESHES = base.loader.load_model('models/asteroids.bam').children
+        self.load_meshes()
 
         self.root = planet.root.attach_new_node("root")
-        mesh = random.choice(self.MESHES)
-        radius = float(mesh.get_tag('radius'))
-        self.root.set_hpr(random.randrange(360), random.randrange(-90, 90), 0)
         self.rotation = self.root.attach_new_node('Rotation')
-        self.asteroid = mesh.instance_to(self.rotation)
-        self.xoff = random.uniform(2, 6)
-        self.yoff = random.uniform(2, 6)
-        self.update_pos(False)
-        mat = core.Material()
-        mat.set_roughness(1)
-        self.asteroid.set_material(mat)
+        self.asteroid = self.rotation.attach_new_node('asteroid')
+        self.asteroid.set_material(self.MATERIAL)
         self.asteroid.set_effect(core.CompassEffect.make(core.NodePath(),
                                  core.CompassEffect.P_scale))
-        self.asteroid.set_pos(self.xoff, self.yoff, -self.planet.size * 4.2 - self.xoff)
-        self.asteroid.node().set_bounds(core.OmniBoundingVolume())
-
-        self._orbit_ival = LerpHprInterval(self.rotation, random.uniform(8, 12), (0, 360, 0))
-        self._spin_ival = LerpHprInterval(self.asteroid, 3.0, (360, 360, 0))
-
-        self._orbit_ival.loop()
-        self._spin_ival.loop()
-
-        self.collider = core.CollisionNode('asteroid')
-        self.collider.add_solid(core.CollisionSphere(center=(0, 0, 0), radius=radius))
-        self.collider.set_into_collide_mask(0b0100)
-        self.collider.set_from_collide_mask(0b0100)
-        self.collider = self.asteroid.attach_new_node(self.collider)
-        self.collider.set_python_tag('asteroid', self)
-        self.asteroid.set_scale(1e-3)
-        self.asteroid.scaleInterval(SCALE_DURATION, 1.0, blendType='easeIn').start()
-
-    def update_pos(self, shout=False):
-        if shout:
-            print(f'before {self.asteroid.get_pos(self.planet.root)} {self.planet.size}')
-        self.asteroid.posInterval(GROWTH_TIME, (
-            self.xoff,
-            self.yoff,
-            -self.planet.size * 4.2 - self.xoff,
-            )
-        ).start()
-        if shout:
-            print(f'after {self.asteroid.get_pos(self.planet.root)}')
+        # The compass effect keeps the asteroid at world scale, which the
+        # bounds of the parent nodes don't know about, but they are only
+        # ever larger since the planet is scaled up, never down
+        self.asteroid.node().set_final(True)
+
+        # Every mesh is instanced once, only the one in use is unstashed
+        self.meshes = [mesh.instance_to(self.asteroid) for mesh in self.MESHES]
+        for mesh in self.meshes:
+            mesh.stash()
+        self.mesh = None
+        self.radius = 0
 
+        self.root.stash()
+        self.xoff = 0
+        self.yoff = 0
+
+    @classmethod
+    def load_meshes(cls):
+        if not cls.MESHES:
+            cls.MESHES = base.loader.load_model('models/asteroids.bam').children
+            cls.MATERIAL = core.Material()
+            cls.MATERIAL.set_roughness(1)
+
+    def spawn(self, plan):
+        """(Re)initializes the asteroid with the mesh and orbit of the given
+        SpawnPlan."""
+        self.set_mesh(plan.mesh_index)
+
+        self.asteroid.reparent_to(self.rotation)
+        self.asteroid.clear_color_scale()
+        self.root.set_hpr(plan.hpr)
+        self.xoff = plan.xoff
+        self.yoff = plan.yoff
+        self.asteroid.set_pos(self.xoff, self.yoff, orbit_distance(self.planet.orbit_size, self.xoff))
+        self.root.unstash()
+
+        self.universe.asteroid_field.add(self, plan.orbit_time, plan.spawn_time)
+
+    def set_mesh(self, index):
+        if self.mesh is not None:
+            self.mesh.stash()
+        self.mesh = self.meshes[index]
+        self.mesh.unstash()
+        self.radius = float(self.mesh.get_tag('radius'))
+        self.asteroid.node().set_bounds(core.BoundingSphere((0, 0, 0), self.radius))
+
+    def place(self, mesh_index, pos, hpr):
+        """Puts the asteroid at a fixed spot relative to the planet root,
+        without adding it to the field."""
+        self.set_mesh(mesh_index)
+        self.asteroid.reparent_to(self.rotation)
+        self.asteroid.clear_color_scale()
+        self.root.set_hpr(0, 0, 0)
+        self.rotation.set_p(0)
+        self.asteroid.set_pos_hpr_scale(pos, hpr, 1)
+        self.root.unstash()
 
     def destroy(self):
-        self.collider.clear_python_tag('asteroid')
-        self.collider.remove_node()
-        self.asteroid.remove_node()
-        self.root.remove_node()
+        self.universe.asteroid_field.remove(self)
+        self.asteroid.reparent_to(self.rotation)
+        self.root.stash()
         self.universe.asteroids.pop(self.universe.asteroids.index(self))
+        self.universe.asteroid_pool.release(self)
 
     def stop(self):
-        self._orbit_ival.pause()
-        self._spin_ival.pause()
+        self.universe.asteroid_field.remove(self)
+
+
+class AsteroidPool:
+    """Keeps a stock of pre-built asteroids around, so that spawning and
+    catching asteroids does not create or tear down any nodes."""
+
+    def __init__(self, planet, universe, size):
+        self.planet = planet
+        self.universe = universe
+        self._free = [Asteroid(planet, universe) for _ in range(size)]
+
+    def acquire(self, plan):
+        if self._free:
+            asteroid = self._free.pop()
+        else:
+            asteroid = Asteroid(self.planet, self.universe)
+        asteroid.spawn(plan)
+        return asteroid
+
+    def acquire_placed(self, mesh_index, pos, hpr):
+        if self._free:
+            asteroid = self._free.pop()
+        else:
+            asteroid = Asteroid(self.planet, self.universe)
+        asteroid.place(mesh_index, pos, hpr)
+        return asteroid
+
+    def release(self, asteroid):
+        self._free.append(asteroid)
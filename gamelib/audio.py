@@ -0,0 +1,139 @@
+"""
+Sound effects, loaded once and shared by everyone who plays them.
+"""
+
+import time
+
+from panda3d import core
+
+
+# How many copies of the same sound may play at the same time by default
+DEFAULT_MAX_VOICES = 2
+
+
+class Sfx:
+    """
+    A sound effect with a limited number of voices, each of which can play it
+    independently.  When all voices are busy, playing it again takes over the
+    voice with the lowest priority, if that is not higher than the new one.
+    Otherwise behaves like an AudioSound.
+    """
+    PLAYING = core.AudioSound.PLAYING
+    READY = core.AudioSound.READY
+
+    def __init__(self, manager, path, max_voices=DEFAULT_MAX_VOICES):
+        self.manager = manager
+        self.path = path
+        self.max_voices = max_voices
+        self.voices = [manager.get_sound(path)]
+        self._priorities = [0]
+        self._started = [0.0]
+        self._volume = None
+        self._loop = None
+
+    def __bool__(self):
+        return bool(self.voices[0])
+
+    def _new_voice(self):
+        # The manager keeps the decoded data around, so this only makes a new
+        # handle to it
+        voice = self.manager.get_sound(self.path)
+        if self._volume is not None:
+            voice.set_volume(self._volume)
+        if self._loop is not None:
+            voice.set_loop(self._loop)
+        self.voices.append(voice)
+        self._priorities.append(0)
+        self._started.append(0.0)
+        return len(self.voices) - 1
+
+    def _pick_voice(self, priority):
+        for i, voice in enumerate(self.voices):
+            if voice.status() != self.PLAYING:
+                return i
+        if len(self.voices) < self.max_voices:
+            return self._new_voice()
+
+        # Steal the least important voice, the oldest one if there is a tie
+        i = min(range(len(self.voices)), key=lambda i: (self._priorities[i], self._started[i]))
+        if self._priorities[i] > priority:
+            return None
+        return i
+
+    def play(self, priority=0):
+        """Plays the sound on a free voice.  Returns False if all voices were
+        busy with sounds of a higher priority."""
+        i = self._pick_voice(priority)
+        if i is None:
+            return False
+        self._priorities[i] = priority
+        self._started[i] = time.monotonic()
+        self.voices[i].play()
+        return True
+
+    def stop(self):
+        for voice in self.voices:
+            voice.stop()
+
+    def status(self):
+        if any(voice.status() == self.PLAYING for voice in self.voices):
+            return self.PLAYING
+        return self.voices[0].status()
+
+    def set_volume(self, volume):
+        self._volume = volume
+        for voice in self.voices:
+            voice.set_volume(volume)
+
+    def set_loop(self, loop=True):
+        self._loop = loop
+        for voice in self.voices:
+            voice.set_loop(loop)
+
+
+class SfxManager:
+    """
+    Hands out the Sfx for each sound in the sfx directory, loading it the
+    first time that it is asked for.  Keeps track of how long the loading
+    took and how much data was loaded.
+    """
+    def __init__(self):
+        self._sounds = {}
+        self.load_time = 0.0
+        self.num_bytes = 0
+
+    def get(self, name, max_voices=DEFAULT_MAX_VOICES):
+        sfx = self._sounds.get(name)
+        if sfx is not None:
+            return sfx
+
+        path = core.Filename(f'sfx/{name}.wav')
+        start = time.perf_counter()
+        sfx = Sfx(base.sfxManagerList[0], path, max_voices)
+        self.load_time += time.perf_counter() - start
+
+        # Wave files are stored uncompressed, so this is about what the
+        # decoded sound takes up as well
+        vfile = core.VirtualFileSystem.get_global_ptr().get_file(path)
+        if vfile is not None:
+            self.num_bytes += vfile.get_file_size()
+
+        self._sounds[name] = sfx
+        return sfx
+
+    def preload(self, names):
+        """Loads the given sounds, if they were not loaded already, and returns
+        a dictionary with the Sfx for each name."""
+        return {name: self.get(name) for name in names}
+
+    @property
+    def stats(self):
+        return {
+            'sounds': len(self._sounds),
+            'voices': sum(len(sfx.voices) for sfx in self._sounds.values()),
+            'load_time': self.load_time,
+            'bytes': self.num_bytes,
+        }
+
+
+sfx_manager = SfxManager()
@@ -5,6 +5,7 @@ from direct.showbase.DirectObject import DirectObject
 from direct.interval import IntervalGlobal as intervals
 from direct.gui.OnscreenText import OnscreenText
 
+from .settings import settings
 from .skybox import Skybox
 import random
 
@@ -25,8 +26,6 @@ ENDING_LINES = [
 
 class CutsceneState(DirectObject):
 
-    cutscene_play_rate = p3d.ConfigVariableDouble('cutscene-play-rate', 1.0)
-
     def __init__(self, cutscene_name, bgm_name, next_state, state_args=None):
         super().__init__()
 
@@ -67,7 +66,7 @@ class CutsceneState(DirectObject):
 
         # Play some background music if available
         if bgm_name:
-            base.set_bgm(bgm_name, loop=False, play_rate=self.cutscene_play_rate.value)
+            base.set_bgm(bgm_name, loop=False, play_rate=settings.cutscene_play_rate)
 
         self.actor = actor
 
@@ -98,7 +97,7 @@ class CutsceneState(DirectObject):
         base.transitions.letterboxOn()
         base.transitions.fadeIn()
         ival = intervals.Sequence(
-            actor.actor_interval('0', playRate=self.cutscene_play_rate.value),
+            actor.actor_interval('0', playRate=settings.cutscene_play_rate),
             base.transitions.getFadeOutIval(),
             *self.get_extra_intervals(),
             intervals.Func(self.ignore, 'space'),
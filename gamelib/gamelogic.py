@@ -1,6 +1,6 @@
 from direct.showbase.DirectObject import DirectObject
-from panda3d import core
 
+from .settings import settings
 from .techtree import TechTree, TechNode
 
 
@@ -33,8 +33,8 @@ class GameLogic(DirectObject):
 
         # Game state
         # FIXME: Set storage cap back to 5 and used to 0 before release!!!
-        self.storage_cap = core.ConfigVariableInt('storage-cap', 5).get_value()
-        self.storage_used = core.ConfigVariableInt('storage-used', 0).get_value()
+        self.storage_cap = settings.storage_cap
+        self.storage_used = settings.storage_used
         self.collected_total = 0
         self.grow_next = PLANET_GROWTH_STEPS[0]
         self.growth_cycle = 0
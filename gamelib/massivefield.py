@@ -0,0 +1,227 @@
+"""
+A variant of the asteroid field for thousands of asteroids at once.  Rather
+than giving every asteroid its own nodes, each asteroid mesh is drawn once with
+hardware instancing, with the per-instance transforms stored in a texture.
+"""
+
+import math
+import time
+
+import numpy as np
+from panda3d import core
+
+from .asteroid import (
+    Asteroid, orbit_positions, spawn_scales,
+    ORBIT_MIN_TIME, ORBIT_MAX_TIME, SPIN_TIME,
+)
+from .renderer import SHADOW_CAMERA_MASK
+from .spatial import UniformGrid
+
+# Must match INSTANCES_PER_ROW in pbr.vert
+INSTANCES_PER_ROW = 256
+
+# Maximum time (in seconds) that spawning may take up each frame, new asteroids
+# are created in batches until it runs out
+SPAWN_BUDGET = 0.002
+SPAWN_BATCH = 64
+
+# Size of the cells of the spatial hash used for catching, relative to the
+# planet root
+GRID_CELL_SIZE = 2.0
+
+
+class _InstancedMesh:
+    """One of the asteroid meshes, drawn once for every instance."""
+    def __init__(self, mesh, parent, capacity):
+        self.rows = max(1, math.ceil(capacity / INSTANCES_PER_ROW))
+        self.texture = core.Texture('asteroid-instances')
+        self.texture.setup_2d_texture(INSTANCES_PER_ROW * 2, self.rows, core.Texture.T_float, core.Texture.F_rgba32)
+        self.texture.set_minfilter(core.SamplerState.FT_nearest)
+        self.texture.set_magfilter(core.SamplerState.FT_nearest)
+        self.texture.set_wrap_u(core.SamplerState.WM_clamp)
+        self.texture.set_wrap_v(core.SamplerState.WM_clamp)
+        self.texture.set_keep_ram_image(True)
+        self._image = np.zeros((self.rows, INSTANCES_PER_ROW * 2, 4), dtype=np.float32)
+
+        self.path = mesh.copy_to(parent)
+        # The instances are spread all over the field, which the bounds of the
+        # mesh know nothing about
+        self.path.node().set_bounds(core.OmniBoundingVolume())
+        self.path.node().set_final(True)
+        self.path.set_shader_inputs(
+            instance_data=self.texture,
+            instance_rows=float(self.rows),
+        )
+        self.path.stash()
+
+    def write(self, placements, spins):
+        """Uploads the given (N, 4) placements and spins, and draws that many
+        instances."""
+        count = len(placements)
+        if count == 0:
+            self.path.stash()
+            return
+
+        texels = self._image.reshape(-1, 2, 4)
+        texels[:count, 0] = placements
+        texels[:count, 1] = spins
+        # Panda stores the color components in BGRA order
+        memoryview(self.texture.modify_ram_image())[:] = self._image[..., [2, 1, 0, 3]].tobytes()
+
+        self.path.set_instance_count(count)
+        self.path.unstash()
+
+
+class MassiveAsteroidField:
+    """
+    Keeps up to count asteroids in orbit around the planet.  Like AsteroidField,
+    the orbits are evaluated from the time since each asteroid was spawned, but
+    the results go straight into the instance data instead of into nodes.  An
+    asteroid is only turned into a real Asteroid once it is caught.
+    """
+    def __init__(self, planet, pool, count, seed=None):
+        self.planet = planet
+        self.pool = pool
+        self.count = count
+        self.time = 0.0
+        self.target_count = 0
+        # Fraction of the asteroids that is kept, lowered on slow machines
+        self.density = 1.0
+        self.rng = np.random.default_rng(seed)
+
+        Asteroid.load_meshes()
+        self.radii = np.array([float(mesh.get_tag('radius')) for mesh in Asteroid.MESHES])
+
+        self.root = planet.root.attach_new_node('massive-field')
+        self.root.set_material(Asteroid.MATERIAL)
+        # The shadow shader does not know how to place the instances
+        self.root.hide(SHADOW_CAMERA_MASK)
+        base.render_pipeline.set_pbr_variant(self.root, {'INSTANCED': ''})
+        self.meshes = [_InstancedMesh(mesh, self.root, count) for mesh in Asteroid.MESHES]
+
+        self._mesh = np.zeros(0, dtype=np.int64)
+        self._spawn_time = np.zeros(0)
+        self._orbit_speed = np.zeros(0)
+        self._offset = np.zeros((0, 2))
+        self._orientation = np.zeros((0, 3, 3))
+        self._spin_axis = np.zeros((0, 3))
+
+        self.positions = np.zeros((0, 3))
+        self.scales = np.zeros(0)
+        self.grid = UniformGrid(GRID_CELL_SIZE)
+
+    def __len__(self):
+        return len(self._mesh)
+
+    def cleanup(self):
+        base.render_pipeline.clear_pbr_variant(self.root)
+        self.root.remove_node()
+
+    def clear(self):
+        """Removes all asteroids, and stops spawning new ones."""
+        self._keep(np.zeros(0, dtype=np.int64))
+        self.count = 0
+        self.target_count = 0
+        self.update(0)
+
+    def _spawn(self, count):
+        heading = np.radians(self.rng.integers(0, 360, count))
+        pitch = np.radians(self.rng.integers(-90, 90, count))
+        ch, sh = np.cos(heading), np.sin(heading)
+        cp, sp = np.cos(pitch), np.sin(pitch)
+        zero = np.zeros(count)
+        # Same as the matrix of a node with the given heading and pitch
+        orientation = np.stack([
+            np.stack([ch, sh, zero], axis=-1),
+            np.stack([-cp * sh, cp * ch, sp], axis=-1),
+            np.stack([sp * sh, -sp * ch, cp], axis=-1),
+        ], axis=1)
+
+        axis = self.rng.normal(size=(count, 3))
+        axis /= np.linalg.norm(axis, axis=1, keepdims=True)
+
+        self._mesh = np.append(self._mesh, self.rng.integers(0, len(self.meshes), count))
+        self._spawn_time = np.append(self._spawn_time, np.full(count, self.time))
+        self._orbit_speed = np.append(self._orbit_speed, 360.0 / self.rng.uniform(ORBIT_MIN_TIME, ORBIT_MAX_TIME, count))
+        self._offset = np.append(self._offset, self.rng.uniform(2, 6, (count, 2)), axis=0)
+        self._orientation = np.append(self._orientation, orientation, axis=0)
+        self._spin_axis = np.append(self._spin_axis, axis, axis=0)
+
+    def _keep(self, indices):
+        self._mesh = self._mesh[indices]
+        self._spawn_time = self._spawn_time[indices]
+        self._orbit_speed = self._orbit_speed[indices]
+        self._offset = self._offset[indices]
+        self._orientation = self._orientation[indices]
+        self._spin_axis = self._spin_axis[indices]
+        self.positions = self.positions[indices]
+        self.scales = self.scales[indices]
+
+    def update(self, dt):
+        self.time += dt
+
+        if len(self) > self.target_count:
+            self._keep(np.arange(self.target_count))
+
+        start = time.perf_counter()
+        while len(self) < self.target_count and time.perf_counter() - start < SPAWN_BUDGET:
+            self._spawn(min(SPAWN_BATCH, self.target_count - len(self)))
+
+        age = self.time - self._spawn_time
+        orbit = np.radians((age * self._orbit_speed) % 360.0)
+        spin = np.radians((age * (360.0 / SPIN_TIME)) % 360.0)
+
+        self.scales = spawn_scales(age)
+        self.positions = orbit_positions(self._offset, self._orientation, orbit, self.planet.orbit_size)
+        self.grid.build(self.positions)
+
+        # The asteroids keep their size when the planet is scaled up
+        placements = np.empty((len(self), 4))
+        placements[:, :3] = self.positions
+        placements[:, 3] = self.scales / self.planet.radius
+        spins = np.empty((len(self), 4))
+        spins[:, :3] = self._spin_axis
+        spins[:, 3] = spin
+
+        order = np.argsort(self._mesh, kind='stable')
+        bounds = np.searchsorted(self._mesh[order], np.arange(len(self.meshes) + 1))
+        for mesh, first, last in zip(self.meshes, bounds[:-1].tolist(), bounds[1:].tolist()):
+            indices = order[first:last]
+            mesh.write(placements[indices], spins[indices])
+
+    def get_radii(self, indices=None):
+        if indices is None:
+            indices = slice(None)
+        return self.radii[self._mesh[indices]] * self.scales[indices] / self.planet.radius
+
+    def hit_test(self, centers, radius):
+        """Returns the indices and distances of the asteroids touching any of
+        the spheres with the given centers (relative to the planet root) and
+        radius, nearest first."""
+        max_radius = radius + self.radii.max() / self.planet.radius
+        hits = {}
+        for center in np.asarray(centers, dtype=float).reshape(-1, 3):
+            candidates = self.grid.query(center, max_radius)
+            if not len(candidates):
+                continue
+            dists = np.linalg.norm(self.positions[candidates] - center, axis=1)
+            touching = dists <= self.get_radii(candidates) + radius
+            for index, dist in zip(candidates[touching].tolist(), dists[touching].tolist()):
+                hits[index] = min(dist, hits.get(index, dist))
+        hits = sorted(hits.items(), key=lambda i: i[1])
+        return [i[0] for i in hits], [i[1] for i in hits]
+
+    def promote(self, index):
+        """Takes the asteroid with the given index out of the field, and
+        returns a real Asteroid in its place."""
+        age = self.time - self._spawn_time[index]
+        angle = math.degrees(age * (2 * math.pi / SPIN_TIME)) % 360.0
+        quat = core.Quat()
+        quat.set_from_axis_angle(angle, core.Vec3(*self._spin_axis[index]))
+        asteroid = self.pool.acquire_placed(
+            int(self._mesh[index]),
+            core.Point3(*self.positions[index]),
+            quat.get_hpr(),
+        )
+        self._keep(np.flatnonzero(np.arange(len(self)) != index))
+        return asteroid
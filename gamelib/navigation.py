@@ -0,0 +1,217 @@
+"""
+Path finding over the planet surface.  The walkable area is a lattice of points
+laid out the same way as the PlanetSide grids, only finer, with the points near
+the props blocked off.
+"""
+
+import heapq
+import math
+
+import numpy as np
+from panda3d import core
+
+
+# Radius of the player's collision spheres, in world units
+PLAYER_RADIUS = 0.5
+
+# Points closer together than this many lattice steps are connected
+NEIGHBOR_STEPS = 1.5
+
+_lattices = {}
+
+
+def _get_lattice(positions):
+    """Returns the neighbors of every point and the angles to them, as a list
+    of (index, angle) lists.  Computed once for every resolution."""
+
+    key = len(positions)
+    lattice = _lattices.get(key)
+    if lattice is not None:
+        return lattice
+
+    # The spacing is widest in the middle of each side
+    resolution = round(math.sqrt(len(positions) / 6))
+    max_angle = 2.0 / resolution * NEIGHBOR_STEPS
+    min_dot = math.cos(max_angle)
+
+    lattice = []
+    for first in range(0, len(positions), 256):
+        dots = positions[first:first + 256] @ positions.T
+        for i, row in enumerate(dots, first):
+            indices = np.flatnonzero(row > min_dot)
+            indices = indices[indices != i]
+            angles = np.arccos(np.minimum(row[indices], 1.0))
+            lattice.append(list(zip(indices.tolist(), angles.tolist())))
+
+    _lattices[key] = lattice
+    return lattice
+
+
+def precompute_lattice(positions):
+    """Computes the lattice for the given (N, 3) normalized positions ahead of
+    time, so that rebuilding with the same resolution later does not stall."""
+    _get_lattice(np.asarray(positions, dtype=float).reshape(-1, 3))
+
+
+class NavGraph:
+    """
+    Keeps track of the obstacles on the surface, each a circle with a radius
+    in world units, and finds paths around them with A*.  Obstacles can be
+    added and removed one at a time, which only touches the points around
+    them.  Found paths are kept until anything changes.
+    """
+    def __init__(self):
+        self.positions = np.zeros((0, 3))
+        self.neighbors = []
+        self.radius = 1.0
+        self.version = 0
+
+        self._obstacles = {}
+        self._blocked = np.zeros(0, dtype=np.int32)
+        self._paths = {}
+        self._obstacle_arrays = None
+
+    def rebuild(self, positions, radius, obstacles):
+        """Replaces the lattice by the given (N, 3) normalized positions, on a
+        planet with the given radius, and blocks off the given iterable of
+        (key, pos, radius) obstacles."""
+
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        self.neighbors = _get_lattice(self.positions)
+        self.radius = radius
+
+        self._obstacles.clear()
+        self._blocked = np.zeros(len(self.positions), dtype=np.int32)
+        for key, pos, obstacle_radius in obstacles:
+            self.set_obstacle(key, pos, obstacle_radius)
+        self._changed()
+
+    def _changed(self):
+        self.version += 1
+        self._paths.clear()
+        self._obstacle_arrays = None
+
+    def set_obstacle(self, key, pos, radius):
+        """Adds an obstacle with the given position and radius, or moves it if
+        there already is one with the given key."""
+
+        if key in self._obstacles:
+            self.remove_obstacle(key)
+
+        pos = np.array(tuple(pos), dtype=float)
+        pos /= np.linalg.norm(pos)
+        clearance = (radius + PLAYER_RADIUS) / self.radius
+        cells = np.flatnonzero(self.positions @ pos > math.cos(min(clearance, math.pi)))
+        self._blocked[cells] += 1
+        self._obstacles[key] = (pos, clearance, cells)
+        self._changed()
+
+    def remove_obstacle(self, key):
+        obstacle = self._obstacles.pop(key, None)
+        if obstacle is not None:
+            self._blocked[obstacle[2]] -= 1
+            self._changed()
+
+    def _nearest_open(self, pos):
+        dots = self.positions @ pos
+        dots[self._blocked > 0] = -2.0
+        return int(np.argmax(dots))
+
+    def _search(self, start, goal):
+        positions = self.positions
+        goal_pos = positions[goal]
+        blocked = self._blocked
+
+        def estimate(node):
+            return math.acos(min(1.0, float(positions[node] @ goal_pos)))
+
+        came_from = {start: None}
+        costs = {start: 0.0}
+        queue = [(estimate(start), start)]
+        while queue:
+            _, node = heapq.heappop(queue)
+            if node == goal:
+                break
+            cost = costs[node]
+            for neighbor, angle in self.neighbors[node]:
+                if blocked[neighbor]:
+                    continue
+                new_cost = cost + angle
+                if new_cost < costs.get(neighbor, math.inf):
+                    costs[neighbor] = new_cost
+                    came_from[neighbor] = node
+                    heapq.heappush(queue, (new_cost + estimate(neighbor), neighbor))
+        else:
+            return None
+
+        path = []
+        while node is not None:
+            path.append(node)
+            node = came_from[node]
+        path.reverse()
+        return path
+
+    def is_clear(self, start, end):
+        """Returns True if nothing is in the way on the great circle between
+        the given normalized points.  Obstacles that either point is already
+        inside of are not counted, since they can only be walked out of."""
+
+        if self._obstacle_arrays is None:
+            if self._obstacles:
+                centers, clearances, _ = zip(*self._obstacles.values())
+                self._obstacle_arrays = (np.array(centers), np.array(clearances))
+            else:
+                self._obstacle_arrays = (np.zeros((0, 3)), np.zeros(0))
+        centers, clearances = self._obstacle_arrays
+        if not len(centers):
+            return True
+
+        start = np.asarray(start, dtype=float)
+        end = np.asarray(end, dtype=float)
+        to_start = np.arccos(np.clip(centers @ start, -1, 1))
+        to_end = np.arccos(np.clip(centers @ end, -1, 1))
+        dists = np.minimum(to_start, to_end)
+
+        normal = np.cross(start, end)
+        length = np.linalg.norm(normal)
+        if length > 1e-9:
+            normal /= length
+            # Closest to a point along the arc, rather than one of its ends
+            along = (np.cross(start, centers) @ normal >= 0) & (np.cross(centers, end) @ normal >= 0)
+            arc_dists = np.arcsin(np.minimum(np.abs(centers @ normal), 1.0))
+            dists = np.where(along, arc_dists, dists)
+
+        inside = (to_start < clearances) | (to_end < clearances)
+        return not np.any((dists < clearances) & ~inside)
+
+    def find_path(self, start, goal):
+        """Returns a list of normalized waypoints that lead from start to goal
+        around the obstacles, ending with goal.  If there is no way around
+        them, heads straight for the goal."""
+
+        goal = core.Vec3(goal).normalized()
+        start_pos = np.array(tuple(core.Vec3(start).normalized()))
+        goal_pos = np.array(tuple(goal))
+        if not len(self.positions) or self.is_clear(start_pos, goal_pos):
+            return [goal]
+
+        key = (self._nearest_open(start_pos), self._nearest_open(goal_pos))
+        if key not in self._paths:
+            self._paths[key] = self._search(*key)
+        nodes = self._paths[key]
+        if nodes is None:
+            return [goal]
+
+        # Cut the corners that the path takes on the lattice
+        points = [start_pos] + [self.positions[i] for i in nodes] + [goal_pos]
+        waypoints = []
+        anchor = 0
+        while anchor < len(points) - 1:
+            next_point = len(points) - 1
+            while next_point > anchor + 1 and not self.is_clear(points[anchor], points[next_point]):
+                next_point -= 1
+            anchor = next_point
+            waypoints.append(core.Vec3(*points[anchor]))
+
+        waypoints[-1] = goal
+        return waypoints
@@ -7,6 +7,7 @@ from direct.interval import IntervalGlobal as intervals
 #from .mainmenu import MainMenu
 from .skybox import Skybox
 from .optionmenuGUI import GUI as OptionGUI
+from .settings import settings
 from .util import srgb_color
 
 import os
@@ -16,8 +17,7 @@ from panda3d.core import (
     loadPrcFile,
     Filename,
     ExecutionEnvironment,
-    WindowProperties,
-    ConfigVariableBool)
+    WindowProperties)
 
 class OptionMenu(DirectObject, OptionGUI):
     def __init__(self):
@@ -83,7 +83,7 @@ class OptionMenu(DirectObject, OptionGUI):
         self.cbFullscreen["command"] = self.cbFullscreenChanged
 
         ## GRAPHICS MODE
-        self.cbGraphicMode["isChecked"] = ConfigVariableBool('potato-mode', False).get_value()
+        self.cbGraphicMode["isChecked"] = settings.potato_mode
         if self.cbGraphicMode['isChecked']:
             self.cbGraphicMode['image'] = self.cbGraphicMode['checkedImage']
         else:
@@ -132,7 +132,7 @@ class OptionMenu(DirectObject, OptionGUI):
         self.cmbResolution["command"] = self.cmbResolutionChanged
 
         ## INVERT Y AXIS TOGGLE
-        self.cbInvertAxis["isChecked"] = p3d.ConfigVariableBool('invert-y-axis', False)
+        self.cbInvertAxis["isChecked"] = settings.invert_y_axis
         if self.cbInvertAxis['isChecked']:
             self.cbInvertAxis['image'] = self.cbInvertAxis['checkedImage']
         else:
@@ -204,9 +204,7 @@ class OptionMenu(DirectObject, OptionGUI):
         base.win.requestProperties(props)
 
     def cbGraphicModeChanged(self, args=None):
-        potato_mode = self.cbGraphicMode['isChecked']
-        base.set_graphics_quality(potato_mode)
-        ConfigVariableBool('potato-mode').setValue(potato_mode)
+        settings.set('potato_mode', self.cbGraphicMode['isChecked'])
 
     def cmbResolutionChanged(self, args):
         resx = int(args.split("x")[0])
@@ -223,8 +221,7 @@ class OptionMenu(DirectObject, OptionGUI):
         base.taskMgr.step()
 
     def cbInvertAxisChanged(self, args=None):
-        invert = self.cbInvertAxis['isChecked']
-        ConfigVariableBool('invert-y-axis').setValue(invert)
+        settings.set('invert_y_axis', self.cbInvertAxis['isChecked'])
 
     def writeConfig(self):
         """Save current config in the prc file or if no prc file exists
@@ -245,8 +242,8 @@ class OptionMenu(DirectObject, OptionGUI):
             "audio-sfx-active": "true" if self.cbSFXAudio["isChecked"] else "false",
             "fullscreen": "true" if self.cbFullscreen["isChecked"] else "false",
             "win-size": "{} {}".format(base.win.getXSize(), base.win.getYSize()),
-            "potato-mode": "true" if ConfigVariableBool('potato-mode', False).get_value() else "false",
-            "invert-y-axis": "true" if ConfigVariableBool('invert-y-axis', False).get_value() else "false",
+            "potato-mode": "true" if settings.potato_mode else "false",
+            "invert-y-axis": "true" if settings.invert_y_axis else "false",
             }
 
         page = None
@@ -0,0 +1,75 @@
+"""
+Finds what the mouse cursor points at on the planet, without going through the
+collision system.
+"""
+
+import math
+
+from panda3d import core
+
+# How far away from a build spot (in world units) the cursor may be on the
+# surface to still pick it, about the size of the build sign
+BUILD_SPOT_PICK_RADIUS = 0.75
+
+
+class SurfacePicker:
+    """
+    Intersects the mouse ray with the planet, which is a unit sphere relative
+    to the planet root, and then looks up the nearest build spot around the
+    hit point in the planet's surface index.
+    """
+    def __init__(self, planet, camera=None):
+        if camera is None:
+            camera = base.cam
+        self.planet = planet
+        self.camera = camera
+        self._near = core.Point3()
+        self._far = core.Point3()
+
+    def cast_ray(self, mpos):
+        """Returns the normalized point relative to the planet root where the
+        ray through the given mouse position first hits the planet, or None if
+        it misses it."""
+        lens = self.camera.node().get_lens()
+        if not lens.extrude(mpos, self._near, self._far):
+            return None
+
+        mat = self.camera.get_mat(self.planet.root)
+        origin = mat.xform_point(self._near)
+        direction = mat.xform_vec(self._far - self._near)
+
+        # Solve |origin + t * direction| = 1 for the nearest t in front
+        a = direction.length_squared()
+        b = origin.dot(direction)
+        c = origin.length_squared() - 1.0
+        disc = b * b - a * c
+        if a == 0 or disc < 0:
+            return None
+        root = math.sqrt(disc)
+        t = (-b - root) / a
+        if t < 0:
+            t = (-b + root) / a
+            if t < 0:
+                return None
+
+        point = origin + direction * t
+        point.normalize()
+        return point
+
+    def find_build_spot(self, point):
+        """Returns the build spot closest to the given surface point, if the
+        cursor is close enough to it to pick it."""
+        max_angle = min(BUILD_SPOT_PICK_RADIUS / self.planet.radius, math.pi)
+        return self.planet.surface_index.nearest(
+            point,
+            max_angle=max_angle,
+            predicate=lambda obj: getattr(obj, 'is_build_spot', False),
+        )
+
+    def pick(self, mpos):
+        """Returns a (point, build_spot) tuple for the given mouse position,
+        either of which may be None."""
+        point = self.cast_ray(mpos)
+        if point is None:
+            return None, None
+        return point, self.find_build_spot(point)
@@ -21,6 +21,8 @@ from panda3d.core import (
 )
 from direct.interval.IntervalGlobal import Parallel, Sequence, Func
 
+from .audio import sfx_manager
+
 
 FONT = DynamicTextFont('assets/fonts/Jellee-Bold.ttf')
 FONT.set_outline((0, 0, 0, 1), 2, 0.2)
@@ -66,9 +68,7 @@ class PieMenu:
             "menu_spam",
             "catched_nothing",
         ]
-        self.sfx = {}
-        for sfx_name in sfx:
-            self.sfx[sfx_name] = loader.load_sfx("sfx/"+sfx_name+".wav")
+        self.sfx = sfx_manager.preload(sfx)
 
 
     def updateCircle(self, newItems):
@@ -1,18 +1,78 @@
+import heapq
+import itertools
 import math
 import random
 
+import numpy as np
 from panda3d import core
 from direct.task.Task import Task
 from direct.interval.LerpInterval import *
 from direct.interval.IntervalGlobal import *
 
 from .util import srgb_color, ease_elastic_out, shake_cam
+from .spatial import SphereIndex
+from .navigation import NavGraph, precompute_lattice
 
 
 BASE_RADIUS = 1
+MAX_SIZE = 5
 GROWTH_TIME = 1.0
 SPROUT_TIME = 1.0
 
+# Props change their face every few seconds
+FACE_CYCLE_MIN_TIME = 3.0
+FACE_CYCLE_MAX_TIME = 9.0
+
+# Resolution of the navigation lattice, in points per slot along each side
+NAV_CELLS_PER_SLOT = 4
+
+# How far the build signs bob up and down, in model units (see pbr.vert)
+SIGN_BOB_HEIGHT = 0.25
+
+
+SIDES = ('+x', '+y', '+z', '-x', '-y', '-z')
+
+_slot_positions = {}
+
+
+def get_slot_positions(size):
+    """Returns the normalized slot positions for a planet of the given size as
+    an array of shape (6, size, size, 3), indexed by side (see SIDES), then by
+    grid row and column.  The tables are computed once and shared."""
+
+    table = _slot_positions.get(size)
+    if table is not None:
+        return table
+
+    coords = ((np.arange(size) * 2 + 1) / size - 1) * (1 - 0.3 / size)
+    u, v = np.meshgrid(coords, coords, indexing='ij')
+    one = np.ones_like(u)
+    table = np.stack([
+        np.stack([one, u, v], axis=-1),
+        np.stack([u, one, v], axis=-1),
+        np.stack([u, v, one], axis=-1),
+        np.stack([-one, u, v], axis=-1),
+        np.stack([u, -one, v], axis=-1),
+        np.stack([u, v, -one], axis=-1),
+    ])
+    table /= np.linalg.norm(table, axis=-1, keepdims=True)
+    table.flags.writeable = False
+    _slot_positions[size] = table
+    return table
+
+
+def precompute_slot_positions(max_size):
+    """Fills the slot position tables for all sizes up to max_size."""
+    for size in range(1, max_size + 1):
+        get_slot_positions(size)
+
+
+def precompute_nav_lattices(max_size):
+    """Builds the navigation lattices for all sizes up to max_size, so that
+    growing the planet does not have to build one in the middle of a frame."""
+    for size in range(1, max_size + 1):
+        precompute_lattice(get_slot_positions(size * NAV_CELLS_PER_SLOT))
+
 
 class Planet:
     """
@@ -39,21 +99,70 @@ class Planet:
         self.collide.node().set_from_collide_mask(0)
         self.collide.node().set_into_collide_mask(1)
 
-        self.sides = [
-            PlanetSide(self, '+x'),
-            PlanetSide(self, '+y'),
-            PlanetSide(self, '+z'),
-            PlanetSide(self, '-x'),
-            PlanetSide(self, '-y'),
-            PlanetSide(self, '-z'),
-        ]
+        precompute_slot_positions(MAX_SIZE)
+        precompute_nav_lattices(MAX_SIZE)
+        self.sides = [PlanetSide(self, side) for side in SIDES]
+
+        self.face_scheduler = FaceScheduler()
+
+        # Positions of the objects on the surface, for proximity queries
+        self.surface_index = SphereIndex()
+
+        # Where the player can walk
+        self.nav = NavGraph()
+
+        # Fraction of the decorative props that is shown
+        self.prop_density = 1.0
+
+        # Scale of the planet root, kept here so that it does not have to be
+        # looked up from the scene graph all the time
+        self.radius = 0.0
+        self.radius_ival = None
+        self.set_radius(BASE_RADIUS + 1)
+
+        # Follows size, but is animated along with the growth of the planet.
+        # The asteroid orbits are derived from this.
+        self.orbit_size = 1.0
+        self.orbit_size_ival = None
+
+        # Lets collision users know when they need to check the surface again
+        self.surface_version = 0
+        self._surface_busy_until = 0.0
 
-        self.root.set_scale(BASE_RADIUS + 1)
         self.new_build_slots = 1
         self.build_slot_queue = []
         self.free_build_slots = 0
         self.set_size(1)
 
+    def cleanup(self):
+        self.face_scheduler.stop()
+        if self.orbit_size_ival is not None:
+            self.orbit_size_ival.pause()
+        if self.radius_ival is not None:
+            self.radius_ival.pause()
+
+    def set_radius(self, radius):
+        self.radius = radius
+        self.root.set_scale(radius)
+
+    def set_prop_density(self, density):
+        """Shows only the given fraction of the props that are just for show,
+        the same ones every time."""
+        self.prop_density = density
+        for side in self.sides:
+            side.apply_prop_density()
+
+    def touch_surface(self, duration=0.0):
+        """Call when objects on the surface were added, removed or changed, or
+        will keep changing for the given duration."""
+        self.surface_version += 1
+        self._surface_busy_until = max(self._surface_busy_until, globalClock.get_frame_time() + duration)
+
+    def is_surface_settled(self, version):
+        """Returns True if nothing on the surface changed since the given
+        surface_version was read."""
+        return version == self.surface_version and globalClock.get_frame_time() > self._surface_busy_until
+
     def grow(self, player_face):
         new_size = self.size + 1
         self.new_build_slots = math.ceil(new_size * 2.4)  # Change factor to increase/decrease build_slots
@@ -73,19 +182,55 @@ class Planet:
 
         for i, side in enumerate(self.sides):
             side._size_changed(size, slots.count(i)) # pylint: disable=protected-access
-
-        self.root.scaleInterval(GROWTH_TIME, BASE_RADIUS + size ** 1.5, blendType='easeInOut').start()
+        self.__rebuild_nav()
+
+        if self.radius_ival is not None:
+            self.radius_ival.finish()
+        self.radius_ival = LerpFunc(
+            self.set_radius,
+            fromData=self.radius,
+            toData=BASE_RADIUS + size ** 1.5,
+            duration=GROWTH_TIME,
+            blendType='easeInOut',
+        )
+        self.radius_ival.start()
+        if self.orbit_size_ival is not None:
+            self.orbit_size_ival.finish()
+        self.orbit_size_ival = LerpFunc(
+            self.__set_orbit_size,
+            fromData=self.orbit_size,
+            toData=size,
+            duration=GROWTH_TIME,
+        )
+        self.orbit_size_ival.start()
+        self.touch_surface(GROWTH_TIME)
         taskMgr.add(self.__resize)
 
+    def __rebuild_nav(self):
+        # Everything is about to move to its new position, so that is where
+        # the obstacles are placed
+        obstacles = []
+        for side in self.sides:
+            for row, row_positions in zip(side.grid, side.new_positions):
+                for obj, pos in zip(row, row_positions):
+                    if obj.nav_radius is not None:
+                        obstacles.append((obj, pos, obj.nav_radius))
+        positions = get_slot_positions(self.size * NAV_CELLS_PER_SLOT)
+        self.nav.rebuild(positions, BASE_RADIUS + self.size ** 1.5, obstacles)
+
+    def __set_orbit_size(self, orbit_size):
+        self.orbit_size = orbit_size
+
     def __resize(self, task):
         # Take x seconds to grow fully
         growth = task.time / GROWTH_TIME
         growth = min(1.0, growth)
 
         for side in self.sides:
-            for row in side.grid:
-                for cell in row:
-                    cell.set_pos(cell.new_pos * growth + cell.old_pos * (1 - growth))
+            side.positions = side.new_positions * growth + side.old_positions * (1 - growth)
+            for row, row_positions in zip(side.grid, side.positions.tolist()):
+                for cell, pos in zip(row, row_positions):
+                    cell.set_pos(pos)
 
         # Begin to sprout new cells when halfway done
         if growth >= 0.5:
@@ -106,19 +251,75 @@ class Planet:
         if self.free_build_slots < 5 and self.build_slot_queue:
             self.build_slot_queue.pop(0).sprout()
             self.free_build_slots += 1
-        if self.size == 5 and not self.build_slot_queue:
+        if self.size == MAX_SIZE and not self.build_slot_queue:
             return task.done
         return task.again
 
 
+class FaceScheduler:
+    """Cycles the faces of all props from a single task.  Slots are kept in a
+    heap ordered by the time their face is due to change next, so that each
+    frame only looks at the faces that actually need updating."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._task = taskMgr.add(self.__update, 'cycle-faces')
+
+    def add(self, slot):
+        next_time = globalClock.get_frame_time() + random.uniform(FACE_CYCLE_MIN_TIME, FACE_CYCLE_MAX_TIME)
+        heapq.heappush(self._heap, (next_time, next(self._counter), slot))
+
+    def stop(self):
+        taskMgr.remove(self._task)
+        self._heap.clear()
+
+    def __update(self, task):
+        heap = self._heap
+        now = globalClock.get_frame_time()
+        while heap and heap[0][0] <= now:
+            next_time, _, slot = heapq.heappop(heap)
+            if slot.face is None:
+                # Slot was destroyed or built over, forget about it
+                continue
+            slot.randomize_face()
+            next_time += random.uniform(FACE_CYCLE_MIN_TIME, FACE_CYCLE_MAX_TIME)
+            heapq.heappush(heap, (max(next_time, now), next(self._counter), slot))
+        return task.cont
+
+
 class PlanetSide:
     def __init__(self, planet, side):
         self.planet = planet
         self.root = planet.root.attach_new_node("side")
         self.side = side
+        self.face = SIDES.index(side)
         self.grid = []
         self.props = []
 
+        # Current, start and target positions of the grid cells during growth
+        self.positions = np.zeros((0, 0, 3))
+        self.old_positions = self.positions
+        self.new_positions = self.positions
+
+    def replace_slot(self, x, y, obj):
+        """Puts a different planet object in the given grid cell."""
+        if self.grid[x][y] in self.props:
+            self.props.remove(self.grid[x][y])
+        self.grid[x][y] = obj
+
+        # The object stays where it is until the planet grows again.  The new
+        # positions are a view of the shared slot table, so copy them first.
+        pos = tuple(obj.get_pos())
+        self.old_positions = np.array(self.old_positions)
+        self.new_positions = np.array(self.new_positions)
+        self.positions[x, y] = pos
+        self.old_positions[x, y] = pos
+        self.new_positions[x, y] = pos
+        if obj.nav_radius is not None:
+            self.planet.nav.set_obstacle(obj, obj.get_pos(), obj.nav_radius)
+        self.planet.touch_surface()
+
     def __grow_grid(self, build_slots):
         # No idea if this calculation works, it's a random guess at a formula
         # to roughly evenly distribute the new rows without spacing starting
@@ -140,6 +341,9 @@ class PlanetSide:
         self.grid.insert(insert_at, new_row)
         new_slots += new_row
 
+        self.positions = np.insert(self.positions, insert_at, 0.0, axis=1)
+        self.positions = np.insert(self.positions, insert_at, 0.0, axis=0)
+
         if new_size == 1:
             # Only crater 2 appears on the baby planet.
             pool = [
@@ -194,46 +398,48 @@ class PlanetSide:
 
         for slot in new_slots:
             slot.attach_model(random.choice(pool))
+            if not slot.build_slot and slot.collider is None:
+                self.props.append(slot)
+        self.apply_prop_density()
+
+    def apply_prop_density(self):
+        # Only props that can be walked through are hidden, so that nothing
+        # invisible gets in the way
+        density = self.planet.prop_density
+        for slot in self.props:
+            if slot.detail_rank < density:
+                slot.model.unstash()
+            else:
+                slot.model.stash()
 
     def _size_changed(self, size, build_slots=0):
         while size > len(self.grid):
             self.__grow_grid(build_slots)
 
-        for x in range(size):
-            for y in range(size):
-                u = ((x * 2 + 1) / size - 1) * (1 - 0.3 / size)
-                v = ((y * 2 + 1) / size - 1) * (1 - 0.3 / size)
-
-                if self.side == '+x':
-                    pos = core.Vec3(1, u, v)
-                elif self.side == '+y':
-                    pos = core.Vec3(u, 1, v)
-                elif self.side == '+z':
-                    pos = core.Vec3(u, v, 1)
-                elif self.side == '-x':
-                    pos = core.Vec3(-1, u, v)
-                elif self.side == '-y':
-                    pos = core.Vec3(u, -1, v)
-                elif self.side == '-z':
-                    pos = core.Vec3(u, v, -1)
-
-                pos.normalize()
-                slot = self.grid[x][y]
-                if slot.sprouted:
-                    slot.old_pos = slot.get_pos()
-                else:
-                    slot.old_pos = pos
-                slot.new_pos = pos
+        self.new_positions = get_slot_positions(size)[self.face]
+        sprouted = np.array([[slot.sprouted for slot in row] for row in self.grid])
+        self.old_positions = np.where(sprouted[..., None], self.positions, self.new_positions)
 
 
 class PlanetObject:
+    # Whether to track this object in the planet's surface_index
+    indexed = False
+
+    # Radius (in world units) that the player has to walk around, if any
+    nav_radius = None
+
     def __init__(self, planet):
+        self.planet = planet
         self.pivot = planet.root.attach_new_node("pivot")
         self.root = self.pivot.attach_new_node("root")
         self.root.set_pos(0, 1, 0)
         self.root.set_hpr(0, -90, 0)
+        if self.indexed:
+            planet.surface_index.insert(self, (0, 1, 0))
 
     def destroy(self):
+        if self.indexed:
+            self.planet.surface_index.remove(self)
         self.root.remove_node()
 
     def apply_pos(self):
@@ -252,14 +458,22 @@ class PlanetObject:
         (snapped to the planet surface)."""
 
         pos = core.Vec3(*pos).normalized()
+        self.set_pos_up(pos, self.pivot.get_quat().get_up())
 
-        up_vector = self.pivot.get_quat().get_up()
+    def set_pos_up(self, pos, up_vector):
+        """Like set_pos, but takes an already normalized position, and the
+        vector that the object's up vector should stay close to."""
         self.pivot.look_at(pos, up_vector)
+        if self.indexed:
+            self.planet.surface_index.move(self, pos)
 
 
 class AssetSlot(PlanetObject):
+    indexed = True
 
     _asset_cache = {}
+    _building_cache = {}
+    _buildings_model = None
     _slot_num = 0
 
     def __init__(self, planet, build_slot=False):
@@ -275,6 +489,7 @@ class AssetSlot(PlanetObject):
         model.reparent_to(self.slot_node)
         self.placeholder = model
         self.collider = None
+        self.face = None
 
         self.build_slot = build_slot
         self.building_placed = False
@@ -282,16 +497,11 @@ class AssetSlot(PlanetObject):
         self.slot_num = AssetSlot._slot_num
         self.build_time = None
 
-        self.planet = planet
         AssetSlot._slot_num += 1
 
     def attach_model(self, fn):
         self.placeholder.remove_node()
 
-        potato_mode = panda3d.core.ConfigVariableBool('potato-mode', False).get_value()
-        if not self.build_slot and potato_mode and random.randint(0, 1):
-            return
-
         if self.build_slot:
             fn = "models/BuildSpaceSign.bam"
 
@@ -303,20 +513,24 @@ class AssetSlot(PlanetObject):
             cached_asset.clear_model_nodes()
             cached_asset.flatten_strong()
             cached_asset.set_shader_input('is_planet_prop', True)
+            if self.build_slot:
+                # The sign is spun and bobbed in the vertex shader, so make
+                # sure the bounds cover the whole animation
+                bmin, bmax = cached_asset.get_tight_bounds()
+                radius = max(abs(i) for i in (bmin.x, bmin.y, bmax.x, bmax.y))
+                center = core.Point3(0, 0, (bmin.z + bmax.z + SIGN_BOB_HEIGHT) / 2)
+                radius = math.hypot(radius, (bmax.z - bmin.z + SIGN_BOB_HEIGHT) / 2)
+                cached_asset.node().set_bounds(core.BoundingSphere(center, radius))
+                cached_asset.set_shader_input('is_build_sign', True)
             self._asset_cache[fn] = cached_asset
 
         if self.build_slot:
             model = cached_asset.copy_to(self.slot_node)
             model.set_scale(0.8)
             model.set_z(0.6)
-            Parallel(
-                Sequence(
-                    LerpPosInterval(model, 0.75, (0, 0, 0.8), startPos=(0, 0, 0.6), blendType='easeInOut'),
-                    LerpPosInterval(model, 0.75, (0, 0, 0.6), startPos=(0, 0, 0.8), blendType='easeInOut'),
-                ),
-                LerpHprInterval(model, 1.5, (360, 0, 0),
-                    startHpr=(0, 0, 0)),
-            ).loop()
+            # Spinning and bobbing is done in the shader, just make sure not
+            # all the signs move in lockstep
+            model.set_shader_input('anim_phase', random.random())
         else:
             model = cached_asset.instance_to(self.slot_node)
             self.slot_node.set_h(random.random() * 360)
@@ -341,6 +555,7 @@ class AssetSlot(PlanetObject):
             self.collider.node().set_from_collide_mask(0b0000)
             self.collider.node().set_into_collide_mask(0b0010)
             #self.collider.show()
+            self.nav_radius = radius
         elif 'buildspacesign' in lower:
             radius = 0.75
             self.collider = self.model.attach_new_node(core.CollisionNode("build_spot"))
@@ -352,13 +567,32 @@ class AssetSlot(PlanetObject):
             #self.collider.show()
         if self.collider:
             self.collider.set_pos(model.get_pos())
+            self.planet.touch_surface()
 
         face = model.find("**/Face/+GeomNode")
         if face:
             self.face = face
             self.randomize_face()
-            # Change face every 3-9 seconds
-            taskMgr.do_method_later(random.random() * 6 + 3, self.__cycle_face, 'cycle-face')
+            self.planet.face_scheduler.add(self)
+
+    def destroy(self):
+        self.face = None
+        if self.collider:
+            self.planet.touch_surface()
+        self.planet.nav.remove_obstacle(self)
+        super().destroy()
+
+    @property
+    def detail_rank(self):
+        """Number between 0 and 1 that decides at which prop density this
+        slot's prop is shown, spread evenly over the slots."""
+        return (self.slot_num * 0.6180339887) % 1.0
+
+    @property
+    def is_build_spot(self):
+        """True if this is a sprouted build sign that can be clicked."""
+        return (self.build_slot and self.sprouted and not self.building_placed
+                and self.collider is not None and not self.collider.is_empty())
 
     def on_hover(self):
         if self.build_slot:
@@ -374,10 +608,6 @@ class AssetSlot(PlanetObject):
         offset = random.choice([(0, 0), (0.5, 0), (0, 0.25), (0, 0.5), (0, 0.75)])
         self.face.set_shader_input('uv_shift', offset, priority=1)
 
-    def __cycle_face(self, task):
-        self.randomize_face()
-        return task.again
-
     def sprout(self):
         if self.sprouted:
             return
@@ -385,11 +615,22 @@ class AssetSlot(PlanetObject):
         self.slot_node.show()
         self.slot_node.scaleInterval(SPROUT_TIME, 1.0).start()
         self.sprouted = True
+        self.planet.touch_surface(SPROUT_TIME)
 
-    def build(self, building_name, time):
-        if self.building_placed:
-            raise RuntimeError('Cannot build here, slot already has a building')
-        building = loader.loadModel("models/buildings.bam").find(f'**/{building_name}')
+    @classmethod
+    def _get_building(cls, building_name):
+        """Returns a prototype of the given building with its spinner joints
+        already set up, loading it on first use."""
+
+        if building_name in cls._building_cache:
+            return cls._building_cache[building_name]
+
+        if cls._buildings_model is None:
+            AssetSlot._buildings_model = loader.loadModel("models/buildings.bam")
+
+        building = cls._buildings_model.find(f'**/{building_name}').copy_to(core.NodePath())
+        building.set_pos(0, 0, 0)
+        joints = []
         for i, hpr in (('rotate_x', (0, 0, 360)), ('rotate_y', (0, 360, 0)), ('rotate_z', (360, 0, 0))):
             spinner = building.find(f'**/={i}')
             if spinner.get_error_type() != 0:
@@ -398,17 +639,39 @@ class AssetSlot(PlanetObject):
             joint.set_transform(spinner.get_transform(building))
             spinner.reparent_to(joint)
             spinner.clear_transform()
+            joints.append((joint, hpr))
+
+        # Remember where the joints end up so that copies can look up their
+        # spinners by index instead of searching for them
+        spinners = [(building.node().find_child(joint.node()), hpr) for joint, hpr in joints]
+
+        collider = building.attach_new_node(core.CollisionNode("collider"))
+        collider.node().add_solid(core.CollisionSphere((0, 0, 0.25), 1))
+        collider.node().set_from_collide_mask(0b0000)
+        collider.node().set_into_collide_mask(0b0010)
+        collider_idx = building.node().find_child(collider.node())
+
+        prototype = (building, spinners, collider_idx)
+        cls._building_cache[building_name] = prototype
+        return prototype
+
+    def build(self, building_name, time):
+        if self.building_placed:
+            raise RuntimeError('Cannot build here, slot already has a building')
+        prototype, spinners, collider_idx = self._get_building(building_name)
+        building = prototype.copy_to(self.slot_node)
+        for child_idx, hpr in spinners:
+            spinner = building.get_child(child_idx).get_child(0)
             spinner.hprInterval(5, hpr, (0, 0, 0)).loop()
         self.collider.remove_node()
         self.model.remove_node()
+        self.face = None
         # self.model = core.NodePath(building_name)
-        self.collider = building.attach_new_node(core.CollisionNode("collider"))
-        self.collider.node().add_solid(core.CollisionSphere((0, 0, 0.25), 1))
-        self.collider.node().set_from_collide_mask(0b0000)
-        self.collider.node().set_into_collide_mask(0b0010)
-        building.set_pos(0, 0, 0)
-        building.reparent_to(self.slot_node)
+        self.collider = building.get_child(collider_idx)
         self.build_time = time
+        self.nav_radius = 1.0
+        self.planet.nav.set_obstacle(self, self.get_pos(), self.nav_radius)
+        self.planet.touch_surface(time)
         taskMgr.add(self.__pop_in)
         #self.slot_node.set_scale(0.000001)
         #self.slot_node.scaleInterval(time, 1).start()
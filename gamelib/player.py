@@ -2,6 +2,7 @@ from panda3d import core
 from direct.actor.Actor import Actor
 
 from .planet import PlanetObject
+from .steering import Steering
 from .util import clamp_angle
 
 
@@ -12,6 +13,7 @@ PLAYER_ROTATE_SPEED = 10
 class Player(PlanetObject):
     def __init__(self, planet):
         super().__init__(planet)
+        self.steering = Steering(self)
 
         # Temporary
         self.model_pos = self.root.attach_new_node('heading')
@@ -42,33 +44,26 @@ class Player(PlanetObject):
         model.find('**/Plane.001').set_two_sided(True)
 
     def move_toward(self, target_pos, dt):
-        """Moves towards the given pos.  If arrived, returns True."""
-
-        # Not quite correct, but probably good enough
-        scale = self.root.get_scale(core.NodePath())[0] * 0.1
-        pos = self.get_pos() * scale
-        target = target_pos * scale
-        delta = (target - pos)
-
-        dummy_np = core.NodePath("dummy")
-        dummy_np.look_at(target - pos)
-        target_h = dummy_np.get_h(self.root)
-        delta_h = ((target_h - self.model.get_h()) + 180) % 360 - 180
-        dist = delta.length()
-        if dist != 0:
-            self.model.set_h(self.model.get_h() + delta_h * min(dt * PLAYER_ROTATE_SPEED, 1))
+        """Moves towards the given normalized pos.  If arrived, returns True."""
+
+        target_h = self.steering.heading_to(target_pos)
+        if target_h is None:
+            target_h = self.model.get_h()
 
-            delta *= PLAYER_WALK_SPEED / dist
+        # Walk the same distance as before, on a planet one tenth of its size
+        max_angle = PLAYER_WALK_SPEED * dt / (self.planet.radius * 0.1)
+        if self.steering.angle_to(target_pos) > max_angle:
+            delta_h = ((target_h - self.model.get_h()) + 180) % 360 - 180
+            self.model.set_h(self.model.get_h() + delta_h * min(dt * PLAYER_ROTATE_SPEED, 1))
 
-            if (delta * dt).length() <= dist:
-                self.set_pos(pos + delta * dt)
-                if self.idle_ctr.playing:
-                    self.idle_ctr.stop()
-                if not self.walk_ctr.playing:
-                    self.walk_ctr.play()
-                return False
+            self.steering.step_toward(target_pos, max_angle)
+            if self.idle_ctr.playing:
+                self.idle_ctr.stop()
+            if not self.walk_ctr.playing:
+                self.walk_ctr.play()
+            return False
 
-        self.set_pos(target_pos)
+        self.steering.step_toward(target_pos, max_angle)
         self.model.set_h(target_h)
 
         if self.walk_ctr.playing:
@@ -86,12 +81,6 @@ class Player(PlanetObject):
         return True
 
     def look_toward(self, target_pos):
-        scale = self.root.get_scale(core.NodePath())[0] * 0.1
-        pos = self.get_pos() * scale
-        target = target_pos * scale
-        delta = (target - pos)
-
-        dummy_np = core.NodePath("dummy")
-        dummy_np.look_at(target - pos)
-        target_h = dummy_np.get_h(self.root)
-        self.model.set_h(target_h)
+        target_h = self.steering.heading_to(target_pos)
+        if target_h is not None:
+            self.model.set_h(target_h)
@@ -9,8 +9,12 @@ from direct.interval.IntervalGlobal import *
 from direct.showbase.DirectObject import DirectObject
 from direct.gui.OnscreenText import OnscreenText
 
+from .audio import sfx_manager
 from .player import Player
-from .planet import PlanetObject
+from .planet import PlanetObject, MAX_SIZE
+from .picking import SurfacePicker
+from .rope import Rope
+from .settings import settings
 from .util import cfg_tuple, shake_cam, srgb_color
 from .pieMenu import PieMenu, PieMenuItem
 
@@ -25,10 +29,14 @@ CHARGE_MAX_TIME = 2.0
 
 BOBBER_SPIN_SPEED = 0.1
 MAGNET_RADIUS = 1.8
+MAGNET_CENTERS = ((-0.3, 1.2, 0), (0.3, 1.2, 0))
 
 # How much distance Obbo keeps from buildings while building
 BUILD_DIST = 1.0
 
+# How close (in world units) Obbo gets to a waypoint before heading to the next
+WAYPOINT_RADIUS = 0.3
+
 # How long Obbo takes to build something, currently length of building animation
 BUILD_TIME = 2.25
 
@@ -46,6 +54,9 @@ REEL_SPEED = 8.0
 # How close the bobber can get to Obbo before ending the reel
 REEL_MIN_DISTANCE = 0.8
 
+# How much the line sags while reeling in a catch, relative to normal
+REEL_SLACK = 0.3
+
 assert CAM_CAST_X_SENSITIVITY > 0.5
 
 
@@ -55,16 +66,15 @@ class PlayerControl(FSM, DirectObject):
         DirectObject.__init__(self)
         self.universe = universe
 
-        self.traverser = core.CollisionTraverser()
-        self.ray = core.CollisionRay()
-        self.root = universe.root
-        self.picker = base.cam.attach_new_node(core.CollisionNode("picker"))
-        self.picker.node().add_solid(self.ray)
-        self.picker.node().set_from_collide_mask(0b0001)
-        self.picker.node().set_into_collide_mask(0b0000)
+        # Every kind of collision test gets its own traverser, which is only
+        # run on the part of the scene that it can actually hit, and only when
+        # something changed since the last time it was run
+        self.surface_traverser = core.CollisionTraverser('surface')
+        self.push_traverser = core.CollisionTraverser('push')
+        self.push_inputs = None
 
-        self.picker_handler = core.CollisionHandlerQueue()
-        self.traverser.add_collider(self.picker, self.picker_handler)
+        self.root = universe.root
+        self.picker = SurfacePicker(universe.planet)
 
         self.player = Player(universe.planet)
         self.player.set_pos((0, 0, 1))
@@ -80,12 +90,12 @@ class PlayerControl(FSM, DirectObject):
         self.raycast_collider.node().set_from_collide_mask(0)
         self.raycast_collider.node().set_into_collide_mask(0)
         self.raycast_handler = core.CollisionHandlerQueue()
-        self.traverser.add_collider(self.raycast_collider, self.raycast_handler)
+        self.surface_traverser.add_collider(self.raycast_collider, self.raycast_handler)
 
         self.pusher = core.CollisionHandlerPusher()
         self.pusher.add_collider(self.player.collider, self.player.root)
-        self.traverser.add_collider(self.player.collider, self.pusher)
-        #self.traverser.show_collisions(render)
+        self.push_traverser.add_collider(self.player.collider, self.pusher)
+        #self.push_traverser.show_collisions(render)
 
         self.bobber = base.loader.load_model('models/bobber.bam')
         self.bobber.reparent_to(self.player.model)
@@ -93,30 +103,17 @@ class PlayerControl(FSM, DirectObject):
         self.bobber.flatten_light()
         self.bobber.stash()
         self.magnet_snap_point = core.Point3(0, MAGNET_SNAP_DIST, 0)
-        bobbercol = core.CollisionNode('Bobber')
-        bobbercol.add_solid(core.CollisionSphere(center=(-0.3, 1.2, 0), radius=MAGNET_RADIUS))
-        bobbercol.add_solid(core.CollisionSphere(center=(0.3, 1.2, 0), radius=MAGNET_RADIUS))
-        bobbercol.set_from_collide_mask(0b0100)
-        bobbercol.set_into_collide_mask(0b0000)
-        self.bobber_collider = self.bobber.attach_new_node(bobbercol)
-        #self.bobber_collider.show()
+        # The magnet spheres are tested against the asteroid field directly,
+        # this node only defines their coordinate space
+        self.bobber_collider = self.bobber.attach_new_node('magnet')
+        self.magnet_centers = [core.Point3(*i) for i in MAGNET_CENTERS]
         self.bobber_bob_ival = None
         self.bobber_cast_complete = False
-        self.asteroid_handler = core.CollisionHandlerQueue()
 
         # Create fishing line.
-        vdata = core.GeomVertexData("line", core.GeomVertexFormat.get_v3(), core.Geom.UH_stream)
-        vdata.set_num_rows(2)
-        lines = core.GeomLines(core.Geom.UH_static)
-        lines.add_next_vertices(2)
-        geom = core.Geom(vdata)
-        geom.add_primitive(lines)
-        self.line = self.player.root.attach_new_node(core.GeomNode('line'))
-        self.line.node().add_geom(geom)
+        self.rope = Rope(self.player.root)
+        self.line = self.rope.root
         self.line.stash()
-        self.line.set_shader_off(1)
-        self.line.node().set_bounds(core.OmniBoundingVolume())
-        self.line.node().set_final(True)
         self.line.set_render_mode_thickness(2)
         self.line.set_antialias(core.AntialiasAttrib.M_line)
 
@@ -129,6 +126,7 @@ class PlayerControl(FSM, DirectObject):
         self.target = Cursor(universe.planet)
         self.target.root.hide()
         self.target_pos = None
+        self.path = []
 
         self.cam_dummy = self.player.root.attach_new_node('cam')
         self.cam_dummy.set_effect(core.CompassEffect.make(core.NodePath(),
@@ -142,8 +140,7 @@ class PlayerControl(FSM, DirectObject):
         self.mouse_last = None
         self.catch = None
 
-        confine_mouse = core.ConfigVariableBool('confine-mouse', False).get_value()
-        if confine_mouse:
+        if settings.confine_mouse:
             self.default_mouse_mode = core.WindowProperties.M_confined
         else:
             self.default_mouse_mode = core.WindowProperties.M_absolute
@@ -166,11 +163,11 @@ class PlayerControl(FSM, DirectObject):
         self.crashed_ship.root.hide()
         self.crashed_ship.set_pos(self.crashed_ship.new_pos)
         self.universe.planet.sides[4].grid[0][0].destroy()
-        self.universe.planet.sides[4].grid[0][0] = self.crashed_ship
+        self.universe.planet.sides[4].replace_slot(0, 0, self.crashed_ship)
 
         self.request('Intro')
 
-        if core.ConfigVariableBool('enable-cheats', False).get_value():
+        if settings.enable_cheats:
             self.accept('space', self.grow)
         self.grown = 0
         self.accept('planet_grow', self.grow)
@@ -189,15 +186,14 @@ class PlayerControl(FSM, DirectObject):
             "obbo_reel_in",
             "obbo_walk",
             "planet_grows",
+            "crash",
         ]
-        self.sfx = {}
-        for sfx_name in sfx:
-            self.sfx[sfx_name] = loader.load_sfx("sfx/"+sfx_name+".wav")
+        self.sfx = sfx_manager.preload(sfx)
         self.sfx["obbo_reel_in"].set_volume(0.8)
         self.sfx["obbo_walk"].set_loop(True)
         self.sfx["menu_spam"].set_volume(0.4)
 
-        self.profile_mode = panda3d.core.ConfigVariableBool('profile-mode', False).get_value()
+        self.profile_mode = settings.profile_mode
         if self.profile_mode:
             for i in range(4):
                 self.grow()
@@ -240,13 +236,10 @@ class PlayerControl(FSM, DirectObject):
         self.player.set_pos((-0.235157, -0.874935, 0.42331))
         self.player.model.set_h(45)
 
-        skip_main_menu = panda3d.core.ConfigVariableBool('skip-main-menu', False).get_value()
-        if skip_main_menu:
+        if settings.skip_main_menu:
             return
 
-        sfx = loader.load_sfx("sfx/crash.wav")
-        if sfx:
-            sfx.play()
+        self.sfx["crash"].play()
 
         base.camera.set_pos((0, -60, 60))
 
@@ -265,8 +258,7 @@ class PlayerControl(FSM, DirectObject):
         base.accept('escape', seq.finish)
 
     def updateIntro(self, dt):
-        skip_main_menu = panda3d.core.ConfigVariableBool('skip-main-menu', False).get_value()
-        if skip_main_menu:
+        if settings.skip_main_menu:
             self.request('Normal')
 
     def exitIntro(self):
@@ -280,7 +272,7 @@ class PlayerControl(FSM, DirectObject):
         taskMgr.do_method_later(1, self.universe.planet.sprout_build_slots, 'bs_spawner')
 
     def grow(self):
-        if self.universe.planet.size > 4:
+        if self.universe.planet.size >= MAX_SIZE:
             print("Can't grow any more!")
             return
 
@@ -359,8 +351,7 @@ class PlayerControl(FSM, DirectObject):
             if self.down_pos:
                 self.target.set_pos(self.down_pos)
                 self.target.root.show()
-                self.target_pos = core.Vec3(*self.down_pos)
-                self.target_pos.normalize()
+                self.walk_to(core.Vec3(*self.down_pos))
                 if not self.player.walk_ctr.is_playing():
                     self.player.walk_ctr.loop('walk')
             self.down_pos = None
@@ -389,7 +380,7 @@ class PlayerControl(FSM, DirectObject):
         if self.target_pos is not None:
             if not self.sfx["obbo_walk"].status() == self.sfx["obbo_walk"].PLAYING:
                 self.sfx["obbo_walk"].play()
-            if self.player.move_toward(self.target_pos, dt):
+            if self.follow_path(dt):
                 # Arrived.
                 self.sfx["menu_spam"].play()
                 self.sfx["obbo_walk"].stop()
@@ -403,7 +394,6 @@ class PlayerControl(FSM, DirectObject):
 
         if base.mouseWatcherNode.has_mouse():
             mpos = base.mouseWatcherNode.get_mouse()
-            self.ray.set_from_lens(base.cam.node(), mpos.x, mpos.y)
 
             if self.profile_mode:
                 self.cam_target_h = 0
@@ -412,57 +402,32 @@ class PlayerControl(FSM, DirectObject):
                 self.cam_target_h = mpos.x * -10
                 self.cam_target_p = mpos.y * -45
 
-            self.traverser.traverse(self.root)
+            self.update_collisions()
 
-            # Make sure position is normalized, in case pusher acted on it
-            self.player.apply_pos()
-
-            if self.picker_handler.get_num_entries() > 0:
-                self.picker_handler.sort_entries()
-                point = self.picker_handler.get_entry(0).get_surface_point(self.root)
-                point.normalize()
-                nd = self.picker_handler.get_entry(0).get_into_node_path().node()
-                pick_type = nd.get_tag('pick_type')
-
-                if pick_type == 'build_spot':
-                    # TODO: I'm not sure why sort_entries doesn't sort by closest,
-                    # maybe with more insight into the picker_handler can improve this?
-                    assets = []
-                    for i in range(self.picker_handler.get_num_entries()):
-                        nd = self.picker_handler.get_entry(i).get_into_node_path().node()
-                        if nd.get_tag('pick_type') == 'build_spot':
-                            assets.append(nd.get_python_tag('asset'))
-                    asset = None
-                    min_dist = float('inf')
-                    for i in assets:
-                        dist = (point - i.get_pos()).length()
-                        if dist < min_dist:
-                            min_dist = dist
-                            asset = i
-
-                    if self.cursor_asset_slot != asset:
-                        asset.on_hover()
-                    self.cursor_asset_slot = asset
-                    self.cursor_pos = None
-                    self.cursor.model.hide()
-                else:
+            point, asset = self.picker.pick(mpos)
+            if asset is not None:
+                if self.cursor_asset_slot != asset:
                     if self.cursor_asset_slot:
                         self.cursor_asset_slot.on_blur()
-                        self.cursor_asset_slot = None
-                    self.cursor_pos = point
-                    self.cursor.set_pos(self.cursor_pos)
-                    self.cursor.model.show()
-            else:
+                    asset.on_hover()
+                self.cursor_asset_slot = asset
+                self.cursor_pos = None
                 self.cursor.model.hide()
-
+            else:
                 if self.cursor_asset_slot:
                     self.cursor_asset_slot.on_blur()
                     self.cursor_asset_slot = None
 
+                if point is not None:
+                    self.cursor_pos = point
+                    self.cursor.set_pos(self.cursor_pos)
+                    self.cursor.model.show()
+                else:
+                    self.cursor.model.hide()
+
             if self.down_time is not None:
                 cur_time = globalClock.frame_time
-                hold_threshold = core.ConfigVariableDouble('click-hold-threshold', 0.3).get_value()
-                if cur_time - self.down_time > hold_threshold:
+                if cur_time - self.down_time > settings.click_hold_threshold:
                     self.down_time = cur_time
                     self.request('Charge')
         else:
@@ -470,6 +435,37 @@ class PlayerControl(FSM, DirectObject):
             self.cursor.model.hide()
             mpos = None
 
+    def walk_to(self, pos):
+        """Sets off toward the given position, around anything in the way."""
+        self.target_pos = pos.normalized()
+        self.path = self.universe.planet.nav.find_path(self.player.get_pos(), self.target_pos)
+
+    def follow_path(self, dt):
+        """Walks along the path toward target_pos.  If arrived, returns True."""
+        # Move on to the next waypoint a little before reaching it, so that
+        # the walk does not stop in between
+        max_angle = WAYPOINT_RADIUS / self.universe.planet.radius
+        while len(self.path) > 1 and self.player.steering.angle_to(self.path[0]) <= max_angle:
+            self.path.pop(0)
+        if not self.path:
+            self.path.append(self.target_pos)
+        return self.player.move_toward(self.path[0], dt)
+
+    def update_collisions(self):
+        """Runs the pusher, if anything that affects it has changed since it
+        was last run."""
+        planet = self.universe.planet
+
+        player_quat = self.player.pivot.get_quat()
+        if (self.push_inputs is None
+                or self.push_inputs[0] != player_quat
+                or not planet.is_surface_settled(self.push_inputs[1])):
+            self.push_traverser.traverse(planet.root)
+
+            # Make sure position is normalized, in case pusher acted on it
+            self.player.apply_pos()
+            self.push_inputs = (self.player.pivot.get_quat(), planet.surface_version)
+
     def exitNormal(self):
         self.cursor.model.hide()
         self.player.walk_ctr.stop()
@@ -519,7 +515,7 @@ class PlayerControl(FSM, DirectObject):
         if rod_tip_pos != crosshair_pos:
             self.raycast_segment.set_point_b(crosshair_pos)
 
-            self.traverser.traverse(self.universe.planet.collide)
+            self.surface_traverser.traverse(self.universe.planet.collide)
 
             if self.raycast_handler.get_num_entries() > 0:
                 self.crosshair.model.set_color_scale(srgb_color(0xfb4771))
@@ -560,7 +556,6 @@ class PlayerControl(FSM, DirectObject):
         props.set_cursor_hidden(True)
         props.set_mouse_mode(core.WindowProperties.M_relative)
         base.win.request_properties(props)
-        self.traverser.add_collider(self.bobber_collider, self.asteroid_handler)
 
     def fling_bobber(self, distance):
         if self.state != 'Cast':
@@ -614,26 +609,26 @@ class PlayerControl(FSM, DirectObject):
             self.updateReel(dt)
         self.start_bob()
 
-        self.traverser.traverse(self.universe.root)
-        self.asteroid_handler.sort_entries()
-
-        hit_asteroids = [
-            i.into_node_path.get_python_tag('asteroid') for i in
-            self.asteroid_handler.entries
-            if i.into_node_path.has_python_tag('asteroid')
-        ]
+        hit_asteroids = self.find_magnet_hits()
 
         if hit_asteroids:
             self.sfx["obbo_reel_in"].play()
             self.request('Reel', hit_asteroids[0])
 
+    def find_magnet_hits(self):
+        """Returns the asteroids within reach of the bobber's magnet, nearest
+        first."""
+        mat = self.bobber_collider.get_mat(self.universe.planet.root)
+        radius = MAGNET_RADIUS * mat.get_row3(0).length()
+        centers = [tuple(mat.xform_point(i)) for i in self.magnet_centers]
+        return self.universe.find_asteroids(centers, radius)
+
     def exitCast(self):
         if self.bobber_bob_ival is not None:
             self.bobber_bob_ival.finish()
             self.bobber_bob_ival = None
         self.bobber_cast_complete = False
         self.sfx["obbo_cast"].stop()
-        self.traverser.remove_collider(self.bobber_collider)
         props = core.WindowProperties()
         props.set_cursor_hidden(False)
         props.set_mouse_mode(self.default_mouse_mode)
@@ -724,7 +719,7 @@ class PlayerControl(FSM, DirectObject):
             return task.done
 
         if self.target_pos is not None and self.build_asset_slot:
-            if self.player.move_toward(self.target_pos, dt):
+            if self.follow_path(dt):
                 # Arrived.
                 self.player.look_toward(self.build_asset_slot.get_pos())
                 self.target_pos = None
@@ -743,11 +738,11 @@ class PlayerControl(FSM, DirectObject):
     def build(self, building, asset_slot):
         if self.universe.game_logic.can_build(building[6:]):
             self.sfx["menu_accept"].play()
-            self.target_pos = core.Vec3(asset_slot.get_pos())
-            dir = core.Vec3(self.target_pos - self.player.get_pos())
+            target_pos = core.Vec3(asset_slot.get_pos())
+            dir = core.Vec3(target_pos - self.player.get_pos())
             dir.normalize()
-            self.target_pos -= dir * BUILD_DIST / self.universe.planet.root.get_scale()[0]
-            self.target_pos.normalize()
+            target_pos -= dir * BUILD_DIST / self.universe.planet.radius
+            self.walk_to(target_pos)
             self.build_asset_slot = asset_slot
             self.build_building = building[6:]
             self.pie_menu.hide(ignore_callback=True)
@@ -755,9 +750,13 @@ class PlayerControl(FSM, DirectObject):
             self.sfx["catched_nothing"].play()
 
     def update_line(self):
-        writer = core.GeomVertexWriter(self.line.node().modify_geom(0).modify_vertex_data(), 'vertex')
-        writer.set_data3(self.player.rod_tip.get_pos(self.player.root))
-        writer.set_data3(self.bobber.get_pos(self.player.root))
+        # The line is pulled taut while something is being reeled in
+        slack = REEL_SLACK if self.state == 'Reel' and self.catch else 1.0
+        self.rope.set_ends(
+            self.player.rod_tip.get_pos(self.player.root),
+            self.bobber.get_pos(self.player.root),
+            slack,
+        )
 
     def update_cast_cam(self):
         if self.state == 'Build':
@@ -768,7 +767,7 @@ class PlayerControl(FSM, DirectObject):
                                -(ptr.y / base.win.get_x_size() * 2 - 1))
 
             self.cam_target_h = mpos.x * -1 * (360 * CAM_CAST_X_SENSITIVITY)
-            invert = -1.0 if core.ConfigVariableBool('invert-y-axis', False) else 1.0
+            invert = -1.0 if settings.invert_y_axis else 1.0
             self.cam_target_p = mpos.y * -45 * invert + 45
 
             border = 0.5 / CAM_CAST_X_SENSITIVITY
@@ -881,6 +880,9 @@ class Cursor(PlanetObject):
 
 
 class CrashedShip(PlanetObject):
+    indexed = True
+    nav_radius = 1.6
+
     def __init__(self, planet):
         super().__init__(planet)
 
@@ -0,0 +1,136 @@
+"""
+Picks how good the game looks from how fast it runs.  The quality tiers go
+from everything on to potato mode, and the governor moves through them based
+on how long the slower frames take.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from panda3d import core
+
+
+# Sent with the new QualityTier whenever the tier changes
+QUALITY_CHANGED_EVENT = 'quality_changed'
+
+QualityTier = namedtuple('QualityTier', [
+    'name',
+    'shadows',
+    'soft_shadows',
+    'shadow_map_size',
+    'prop_density',
+    'asteroid_density',
+    'color_grading',
+])
+
+TIERS = [
+    QualityTier('high', True, True, 2048, 1.0, 1.0, True),
+    QualityTier('medium', True, False, 1024, 1.0, 0.75, True),
+    QualityTier('low', True, False, 512, 0.5, 0.5, True),
+    QualityTier('potato', False, False, 512, 0.5, 0.25, False),
+]
+
+# Number of recent frames that the percentile is taken over
+FRAME_HISTORY = 120
+
+# Which of the frames is looked at, the slower ones matter most
+FRAME_PERCENTILE = 90
+
+# Frames this long are loading hitches rather than a sign of slowness
+HITCH_TIME = 0.25
+
+# The tier goes down when the frame time is this much over budget, and up when
+# it fits in the budget again
+DOWNGRADE_FACTOR = 1.25
+UPGRADE_FACTOR = 1.05
+
+# How long to wait after a change before going down or up again.  When going
+# up does not last, the next attempt waits twice as long.
+DOWNGRADE_DELAY = 2.0
+UPGRADE_DELAY = 10.0
+MAX_UPGRADE_DELAY = 160.0
+
+
+class QualityGovernor:
+    """
+    Keeps the frame times of the last frames, and steps down a tier when the
+    slower ones of them take too long, or back up when they have fit in the
+    budget for a while.  The tier can also be pinned, which stops it from
+    changing.  The pipeline settings are applied here, everything else that
+    depends on the tier listens for QUALITY_CHANGED_EVENT.
+    """
+    def __init__(self, pipeline, target_fps=60.0, enabled=True):
+        self.pipeline = pipeline
+        self.budget = 1.0 / target_fps
+        self.enabled = enabled
+        self.pinned = None
+        self.tier_index = 0
+
+        self._lut_texture = pipeline.lut_texture
+        self._frame_times = np.zeros(FRAME_HISTORY)
+        self._num_frames = 0
+        self._since_change = 0.0
+        self._upgrade_delay = UPGRADE_DELAY
+        self._last_upgrade = None
+
+        self._apply()
+        self._task = taskMgr.add(self.__update, 'quality governor')
+
+    @property
+    def tier(self):
+        return TIERS[self.tier_index]
+
+    def pin(self, tier_index):
+        """Keeps the given tier.  With None, goes back to the best tier and
+        lets the governor take over again."""
+        self.pinned = tier_index
+        self._upgrade_delay = UPGRADE_DELAY
+        self._last_upgrade = None
+        if tier_index is None:
+            self._set_tier(0, 'unpinned')
+        else:
+            self._set_tier(tier_index, 'pinned')
+
+    def _set_tier(self, tier_index, reason):
+        if tier_index == self.tier_index:
+            return
+        print(f'Quality: {self.tier.name} -> {TIERS[tier_index].name} ({reason})')
+        self.tier_index = tier_index
+        self._since_change = 0.0
+        self._num_frames = 0
+        self._apply()
+        messenger.send(QUALITY_CHANGED_EVENT, [self.tier])
+
+    def _apply(self):
+        tier = self.tier
+        self.pipeline.enable_shadows = tier.shadows
+        self.pipeline.soft_shadows = tier.soft_shadows
+        self.pipeline.lut_texture = self._lut_texture if tier.color_grading else None
+
+    def __update(self, task):
+        dt = core.ClockObject.get_global_clock().get_dt()
+        self._since_change += dt
+        if not self.enabled or self.pinned is not None or dt > HITCH_TIME:
+            return task.cont
+
+        self._frame_times[self._num_frames % FRAME_HISTORY] = dt
+        self._num_frames += 1
+        if self._num_frames < FRAME_HISTORY:
+            return task.cont
+
+        frame_time = np.percentile(self._frame_times, FRAME_PERCENTILE)
+        reason = f'{FRAME_PERCENTILE}th percentile frame time {frame_time * 1000:.1f} ms'
+        if (frame_time > self.budget * DOWNGRADE_FACTOR
+                and self._since_change > DOWNGRADE_DELAY
+                and self.tier_index < len(TIERS) - 1):
+            if self._last_upgrade == self.tier_index:
+                # Did not manage to stay up there, so wait longer next time
+                self._upgrade_delay = min(self._upgrade_delay * 2, MAX_UPGRADE_DELAY)
+            self._last_upgrade = None
+            self._set_tier(self.tier_index + 1, reason)
+        elif (frame_time < self.budget * UPGRADE_FACTOR
+                and self._since_change > self._upgrade_delay
+                and self.tier_index > 0):
+            self._last_upgrade = self.tier_index - 1
+            self._set_tier(self.tier_index - 1, reason)
+        return task.cont
@@ -1,20 +1,44 @@
 # Based heavily on the BSD licensed panda3d-simplepbr (https://github.com/Moguri/panda3d-simplepbr/)
+import hashlib
+import os
+
 import panda3d.core as p3d
 
 from direct.filter.CommonFilters import CommonFilters
 
 
 __all__ = [
-    'Pipeline'
+    'Pipeline',
+    'SHADOW_CAMERA_MASK',
 ]
 
+
+# Camera mask of the shadow casting lights, nodes can use node.hide() with this
+# mask to stay out of the shadow maps
+SHADOW_CAMERA_MASK = p3d.BitMask32.bit(1)
+
+# How quickly the measured frame time follows changes, in seconds
+FRAME_TIME_WINDOW = 0.5
+
+# With dynamic resolution, the render scale is changed in steps of this size,
+# and not again until the frame time had some time to settle
+RENDER_SCALE_STEP = 0.1
+RENDER_SCALE_DOWN_DELAY = 0.5
+RENDER_SCALE_UP_DELAY = 3.0
+
 class CommonFiltersEx(CommonFilters):
+    render_scale = 1.0
+
     def reconfigure(self, fullrebuild, changed):
         retval = super().reconfigure(fullrebuild, changed)
 
         if not retval:
             return retval
 
+        if fullrebuild:
+            # The scene buffer was just made again at the window size
+            self.setRenderScale(self.render_scale)
+
         lut_texture = self.configuration.get('ColorGrade', None)
         if lut_texture is not None:
             shader = self.finalQuad.get_shader()
@@ -43,6 +67,14 @@ class CommonFiltersEx(CommonFilters):
             return self.reconfigure(True, 'ColorGrade')
         return True
 
+    def setRenderScale(self, scale): # pylint: disable=invalid-name
+        """Renders the scene at the given fraction of the window size, the
+        final pass scales it back up"""
+        self.render_scale = scale
+        if self.manager.buffers:
+            self.manager.sizes[0] = (scale, 1, 1)
+            self.manager.resizeBuffers()
+
     def delColorGrade(self): # pylint: disable=invalid-name
         if 'ColorGrade' in self.configuration:
             del self.configuration['ColorGrade']
@@ -75,11 +107,30 @@ def _add_shader_defines(shaderstr, defines):
     )
 
 
-def _load_shader_str(shadername, defines=None):
+# Contents of the shader files and a hash of them, by path, along with the
+# modification time they were read at, so that edits are picked up
+_shader_sources = {}
+
+# Shaders by the hashes of their sources and the defines they were made with
+_shader_cache = {}
+
+
+def _read_shader_file(shadername):
     shaderpath = p3d.Filename.expand_from(f'$MAIN_DIR/shaders/{shadername}').to_os_specific()
+    mtime = os.path.getmtime(shaderpath)
+
+    source = _shader_sources.get(shaderpath)
+    if source is None or source[0] != mtime:
+        with open(shaderpath) as shaderfile:
+            shaderstr = shaderfile.read()
+
+        source = (mtime, shaderstr, hashlib.sha1(shaderstr.encode('utf-8')).hexdigest())
+        _shader_sources[shaderpath] = source
+    return source[1:]
 
-    with open(shaderpath) as shaderfile:
-        shaderstr = shaderfile.read()
+
+def _load_shader_str(shadername, defines=None):
+    shaderstr = _read_shader_file(shadername)[0]
 
     if defines is not None:
         shaderstr = _add_shader_defines(shaderstr, defines)
@@ -87,6 +138,25 @@ def _load_shader_str(shadername, defines=None):
     return shaderstr
 
 
+def _make_shader(vertname, fragname, defines=None):
+    """Returns the GLSL shader made from the given files with the given
+    defines, which is only made once for every combination."""
+    key = (
+        _read_shader_file(vertname)[1],
+        _read_shader_file(fragname)[1],
+        tuple(sorted((str(k), str(v)) for k, v in defines.items())) if defines is not None else None,
+    )
+    shader = _shader_cache.get(key)
+    if shader is None:
+        shader = p3d.Shader.make(
+            p3d.Shader.SL_GLSL,
+            vertex=_load_shader_str(vertname, defines),
+            fragment=_load_shader_str(fragname, defines),
+        )
+        _shader_cache[key] = shader
+    return shader
+
+
 class Pipeline:
     def __init__(
             self,
@@ -101,6 +171,9 @@ class Pipeline:
             enable_specular=True,
             use_occlusion_maps=False,
             lut_texture=None,
+            dynamic_resolution=False,
+            target_fps=60.0,
+            min_render_scale=0.5,
     ):
         if render_node is None:
             render_node = base.render
@@ -124,6 +197,13 @@ class Pipeline:
         self.soft_shadows = soft_shadows
         self.exposure = exposure
         self.lut_texture = lut_texture
+        self._pbr_variants = []
+        self._casters = []
+        self.dynamic_resolution = dynamic_resolution
+        self.target_fps = target_fps
+        self.min_render_scale = min_render_scale
+        self.frame_time = 1.0 / target_fps
+        self._render_scale_delay = 0.0
 
         # Default Material
         if not render_node.has_material():
@@ -144,8 +224,8 @@ class Pipeline:
         # Tonemapping
         self._setup_tonemapping()
 
-        # Do updates based on scene changes
-        taskmgr.add(self._update, 'render update')
+        # Adjust the resolution to the frame rate
+        taskmgr.add(self._update_render_scale, 'dynamic resolution')
 
         self._shader_ready = True
 
@@ -169,8 +249,10 @@ class Pipeline:
             self.filters.setExposureAdjust(self.exposure)
         elif name == 'lut_texture':
             self.filters.setColorGrade(value)
+        elif name == 'dynamic_resolution' and not value:
+            self.filters.setRenderScale(1.0)
 
-    def _recompile_pbr(self):
+    def _make_pbr_shader(self, extra_defines=None):
         pbr_defines = {
             'MAX_LIGHTS': self.max_lights,
         }
@@ -178,16 +260,45 @@ class Pipeline:
             pbr_defines['ENABLE_SHADOWS'] = ''
         if self.soft_shadows:
             pbr_defines['SOFT_SHADOWS'] = ''
+        if extra_defines is not None:
+            pbr_defines.update(extra_defines)
 
-        pbr_vert_str = _load_shader_str('pbr.vert', pbr_defines)
-        pbr_frag_str = _load_shader_str('pbr.frag', pbr_defines)
-        pbrshader = p3d.Shader.make(
-            p3d.Shader.SL_GLSL,
-            vertex=pbr_vert_str,
-            fragment=pbr_frag_str,
+        return _make_shader('pbr.vert', 'pbr.frag', pbr_defines)
+
+    def _recompile_pbr(self):
+        self.render_node.set_shader(self._make_pbr_shader())
+        self.render_node.set_shader_inputs(
+            is_planet_prop=False,
+            is_build_sign=False,
+            anim_phase=0.0,
         )
-        self.render_node.set_shader(pbrshader)
-        self.render_node.set_shader_input('is_planet_prop', False)
+
+        self._pbr_variants = [
+            (nodepath, defines)
+            for nodepath, defines in self._pbr_variants
+            if not nodepath.is_empty()
+        ]
+        for nodepath, defines in self._pbr_variants:
+            nodepath.set_shader(self._make_pbr_shader(defines))
+
+    def set_pbr_variant(self, nodepath, defines):
+        """Applies a variant of the PBR shader that is compiled with extra
+        defines to the given node.  The variant is recompiled along with the
+        main shader whenever the pipeline settings change."""
+        defines = dict(defines)
+        self._pbr_variants.append((nodepath, defines))
+        nodepath.set_shader(self._make_pbr_shader(defines))
+
+    def clear_pbr_variant(self, nodepath):
+        """Stops keeping the PBR shader variant of the given node up to date,
+        and removes it from the node."""
+        self._pbr_variants = [
+            (i, defines)
+            for i, defines in self._pbr_variants
+            if i != nodepath and not i.is_empty()
+        ]
+        if not nodepath.is_empty():
+            nodepath.clear_shader()
 
     def _setup_tonemapping(self):
         if self._shader_ready:
@@ -205,38 +316,62 @@ class Pipeline:
         self.filters.setExposureAdjust(self.exposure)
         self.filters.setColorGrade(self.lut_texture)
 
-    def get_all_casters(self):
-        return [
-            i.node()
-            for i in self.render_node.find_all_matches('**/+LightLensNode')
-            if i.node().is_shadow_caster()
-        ]
+    def register_caster(self, nodepath):
+        """Sets up the given shadow casting light to render its shadow map
+        with the shadow shader.  Needs to be called for every caster, the
+        pipeline does not go looking for them."""
+        caster = nodepath.node()
 
-    def _update(self, task):
         # Use a simpler, faster shader for shadows
-        for caster in self.get_all_casters():
-            state = caster.get_initial_state()
-            if not state.has_attrib(p3d.ShaderAttrib):
-                shader = p3d.Shader.make(
-                    p3d.Shader.SL_GLSL,
-                    vertex=_load_shader_str('shadow.vert'),
-                    fragment=_load_shader_str('shadow.frag')
-                )
-                state = state.add_attrib(p3d.ShaderAttrib.make(shader), 1)
-                state = state.set_attrib(p3d.CullFaceAttrib.make_default(), 100000)
-                caster.set_initial_state(state)
-
-        # Use the auto-shader for node types that simplepbr does not support
-        unsupported_types = [
-            'TextNode',
-        ]
-        nodes = [
-            node
-            for node_type in unsupported_types
-            for node in self.render_node.find_all_matches(f'**/+{node_type}')
-        ]
-        for node in nodes:
-            if not node.has_attrib(p3d.ShaderAttrib):
-                node.set_shader_auto(True)
+        state = caster.get_initial_state()
+        if not state.has_attrib(p3d.ShaderAttrib):
+            shader = _make_shader('shadow.vert', 'shadow.frag')
+            state = state.add_attrib(p3d.ShaderAttrib.make(shader), 1)
+            state = state.set_attrib(p3d.CullFaceAttrib.make_default(), 100000)
+            caster.set_initial_state(state)
+
+        self._casters = [i for i in self._casters if not i.was_deleted()]
+        self._casters.append(p3d.WeakNodePath(nodepath))
+
+    def get_all_casters(self):
+        casters = []
+        for weak_path in self._casters:
+            if weak_path.was_deleted():
+                continue
+            caster = weak_path.get_node_path().node()
+            if caster.is_shadow_caster():
+                casters.append(caster)
+        return casters
+
+    @property
+    def render_scale(self):
+        return self.filters.render_scale
+
+    def _update_render_scale(self, task):
+        if not self.dynamic_resolution:
+            return task.cont
+
+        # Panda only knows the GPU time when PStats asks for it, but a frame
+        # that waits on the GPU takes longer all the same
+        dt = p3d.ClockObject.get_global_clock().get_dt()
+        self.frame_time += (dt - self.frame_time) * min(dt / FRAME_TIME_WINDOW, 1.0)
+
+        self._render_scale_delay -= dt
+        if self._render_scale_delay > 0:
+            return task.cont
+
+        target = 1.0 / self.target_fps
+        scale = self.render_scale
+        if self.frame_time > target * 1.1:
+            scale = max(self.min_render_scale, round(scale - RENDER_SCALE_STEP, 2))
+            delay = RENDER_SCALE_DOWN_DELAY
+        elif self.frame_time < target * 1.02:
+            scale = min(1.0, round(scale + RENDER_SCALE_STEP, 2))
+            delay = RENDER_SCALE_UP_DELAY
+        else:
+            return task.cont
 
+        if scale != self.render_scale:
+            self.filters.setRenderScale(scale)
+            self._render_scale_delay = delay
         return task.cont
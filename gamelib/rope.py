@@ -0,0 +1,79 @@
+import numpy as np
+import panda3d.core as p3d
+
+# Number of straight segments that make up the curve
+ROPE_SEGMENTS = 24
+
+# How far the middle of the rope sags, relative to its length
+ROPE_SAG = 0.15
+
+_ROPE_VERT = """
+#version 120
+
+uniform mat4 p3d_ModelViewProjectionMatrix;
+
+// Start and end point of the rope, the w component of the start holds the sag
+uniform vec4 rope[2];
+
+attribute vec4 p3d_Vertex;
+
+void main() {
+    float t = p3d_Vertex.x;
+    vec3 pos = mix(rope[0].xyz, rope[1].xyz, t);
+    pos.z -= rope[0].w * 4.0 * t * (1.0 - t);
+    gl_Position = p3d_ModelViewProjectionMatrix * vec4(pos, 1.0);
+}
+"""
+
+_ROPE_FRAG = """
+#version 120
+
+uniform vec4 p3d_ColorScale;
+
+void main() {
+    gl_FragColor = p3d_ColorScale;
+}
+"""
+
+
+class Rope:
+    """
+    A line that hangs between two points, curving down along the -Z axis of
+    its parent.  The vertices only hold the position along the rope, the
+    actual curve is computed in the shader from an array that is shared with
+    it, so moving the rope does not touch the geometry or the render state.
+    """
+    def __init__(self, parent, segments=ROPE_SEGMENTS):
+        vdata = p3d.GeomVertexData("rope", p3d.GeomVertexFormat.get_v3(), p3d.Geom.UH_static)
+        vdata.set_num_rows(segments + 1)
+        writer = p3d.GeomVertexWriter(vdata, 'vertex')
+        for i in range(segments + 1):
+            writer.set_data3(i / segments, 0, 0)
+        strip = p3d.GeomLinestrips(p3d.Geom.UH_static)
+        strip.add_next_vertices(segments + 1)
+        strip.close_primitive()
+        geom = p3d.Geom(vdata)
+        geom.add_primitive(strip)
+
+        self.root = parent.attach_new_node(p3d.GeomNode('rope'))
+        self.root.node().add_geom(geom)
+        self.root.node().set_bounds(p3d.OmniBoundingVolume())
+        self.root.node().set_final(True)
+        self.root.set_shader(p3d.Shader.make(
+            p3d.Shader.SL_GLSL,
+            vertex=_ROPE_VERT,
+            fragment=_ROPE_FRAG,
+        ), 1)
+
+        # Writing into this view changes what the shader sees
+        self.ends = p3d.PTA_LVecBase4f.empty_array(2)
+        self.root.set_shader_input('rope', self.ends)
+        self._ends = np.frombuffer(memoryview(self.ends), dtype=np.float32).reshape(2, 4)
+        self._ends[:] = 0
+
+    def set_ends(self, start, end, slack=1.0):
+        """Hangs the rope between the given points relative to its parent.
+        With a slack of 0, the rope is pulled straight."""
+        self._ends[0, :3] = start
+        self._ends[1, :3] = end
+        self._ends[0, 3] = (end - start).length() * ROPE_SAG * slack
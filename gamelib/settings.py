@@ -0,0 +1,88 @@
+"""
+Typed access to the configuration variables used by the game.  The variables
+are read from the PRC files once, after which the rest of the game only reads
+plain attributes of the settings object.
+"""
+
+from panda3d import core
+
+
+# Sent with the attribute name and the new value whenever a setting changes
+SETTINGS_CHANGED_EVENT = 'settings_changed'
+
+# Name, type and default value of every variable, they are available as
+# attributes with the dashes replaced by underscores
+VARIABLES = [
+    ('potato-mode', bool, False),
+    ('profile-mode', bool, False),
+    ('skip-main-menu', bool, False),
+    ('enable-cheats', bool, False),
+    ('esc-to-exit', bool, False),
+    ('confine-mouse', bool, False),
+    ('invert-y-axis', bool, False),
+    ('click-hold-threshold', float, 0.3),
+    ('audio-music-volume', float, 1.0),
+    ('audio-sfx-volume', float, 1.0),
+    ('cutscene-play-rate', float, 1.0),
+    ('storage-cap', int, 5),
+    ('storage-used', int, 0),
+    ('asteroid-seed', int, -1),
+    ('asteroid-field-mode', str, 'normal'),
+    ('asteroid-field-count', int, 2000),
+    ('shadow-map-max-size', int, 2048),
+    ('dynamic-resolution', bool, False),
+    ('target-fps', float, 60.0),
+    ('min-render-scale', float, 0.5),
+    ('quality-governor', bool, True),
+]
+
+_CONFIG_TYPES = {
+    bool: core.ConfigVariableBool,
+    int: core.ConfigVariableInt,
+    float: core.ConfigVariableDouble,
+    str: core.ConfigVariableString,
+}
+
+
+def _attr_name(name):
+    return name.replace('-', '_')
+
+
+class Settings:
+    def __init__(self):
+        self._variables = {}
+        for name, var_type, default in VARIABLES:
+            setattr(self, _attr_name(name), default)
+
+    def _get_variable(self, name):
+        if name not in self._variables:
+            var_type, default = next((t, d) for n, t, d in VARIABLES if n == name)
+            self._variables[name] = _CONFIG_TYPES[var_type](name, default)
+        return self._variables[name]
+
+    def load(self):
+        """Loads settings.prc and, if there is one, the user.prc that overrides
+        it, then reads all variables."""
+        core.load_prc_file(core.Filename.expand_from('$MAIN_DIR/settings.prc'))
+
+        user_config_path = core.Filename.expand_from('$MAIN_DIR/user.prc')
+        if user_config_path.exists():
+            core.load_prc_file(user_config_path)
+
+        self.reload()
+
+    def reload(self):
+        """Reads all variables again from the loaded PRC pages."""
+        for name, var_type, default in VARIABLES:
+            setattr(self, _attr_name(name), var_type(self._get_variable(name).get_value()))
+
+    def set(self, attr, value):
+        """Changes the setting with the given attribute name for the rest of the
+        session, and lets everyone know about it."""
+        name = attr.replace('_', '-')
+        self._get_variable(name).set_value(value)
+        setattr(self, attr, value)
+        messenger.send(SETTINGS_CHANGED_EVENT, [attr, value])
+
+
+settings = Settings()
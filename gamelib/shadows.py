@@ -0,0 +1,85 @@
+"""
+Keeps the shadow map of the sun focused on the part of the planet around the
+player, which is all that the camera gets to see once the planet has grown.
+"""
+
+import math
+
+from .settings import settings
+
+
+# Radius (in world units) around the player that needs shadows, this is about
+# what the camera sees while following the player
+VIEW_RADIUS = 12.0
+
+# Extra room around the area, for props near the edge that cast into it
+MARGIN = 1.0
+
+# Depth range of the shadow lens, relative to the planet root
+NEAR_FAR = (-4, 1)
+
+# How many shadow map texels the budget allows for every world unit
+TEXELS_PER_UNIT = 96
+
+MIN_BUFFER_SIZE = 256
+
+# The film does not shrink until it is this much larger than needed, so that
+# the texels do not change size all the time
+SHRINK_MARGIN = 0.1
+
+
+class ShadowFitter:
+    """
+    Fits the film of the given directional light, which is parented to the
+    planet root, around the player.  The film is moved in whole texels, so
+    that the shadows do not crawl while walking.  The shadow map size follows
+    the size of the film in world units, up to max_size, and is only ever
+    made larger while the planet grows.
+    """
+    def __init__(self, light_path, planet, target):
+        self.light_path = light_path
+        self.planet = planet
+        self.target = target
+        self.max_size = settings.shadow_map_max_size
+
+        self.light = light_path.node()
+        self.lens = self.light.get_lens()
+        self.lens.set_near_far(*NEAR_FAR)
+
+        # The light never moves relative to the planet
+        self._to_light = planet.root.get_mat(light_path)
+        self.film_size = 0.0
+        self.buffer_size = 0
+
+    def _choose_buffer_size(self, world_size):
+        size = 2 ** round(math.log2(max(world_size * TEXELS_PER_UNIT, 1)))
+        size = max(MIN_BUFFER_SIZE, min(size, self.max_size))
+        if size > self.buffer_size or self.buffer_size > self.max_size:
+            self.buffer_size = size
+            self.light.set_shadow_buffer_size((size, size))
+
+    def set_max_size(self, max_size):
+        """Changes the largest shadow map size that may be used."""
+        self.max_size = max_size
+        self._choose_buffer_size(self.film_size * self.planet.radius)
+
+    def update(self):
+        radius = self.planet.radius
+
+        # The whole planet fits in a film of 3 (relative to the planet root)
+        film_size = min(2 * (VIEW_RADIUS + MARGIN) / radius, 3.0)
+        if film_size > self.film_size or film_size < self.film_size * (1 - SHRINK_MARGIN):
+            self.film_size = film_size
+            self.lens.set_film_size(film_size, film_size)
+            self._choose_buffer_size(film_size * radius)
+
+        if self.film_size >= 3.0:
+            self.lens.set_film_offset(0, 0)
+            return
+
+        center = self._to_light.xform_point(self.target.get_pos())
+        texel = self.film_size / self.buffer_size
+        self.lens.set_film_offset(
+            round(center.x / texel) * texel,
+            round(center.z / texel) * texel,
+        )
@@ -0,0 +1,213 @@
+"""
+Provides spatial indices for objects placed on the surface of a unit sphere,
+and for large numbers of points moving freely through space.
+"""
+
+import math
+
+import numpy as np
+
+
+def _normalized(pos):
+    x, y, z = pos
+    length = math.sqrt(x * x + y * y + z * z)
+    if length == 0:
+        raise ValueError('Cannot index a zero-length position')
+    return x / length, y / length, z / length
+
+
+def _face_coords(x, y, z):
+    """Projects a direction onto the cube, returning the face (as indexed in
+    planet.SIDES) and the (u, v) coordinates on it, each in the range -1..1."""
+    ax, ay, az = abs(x), abs(y), abs(z)
+    if ax >= ay and ax >= az:
+        return (0 if x > 0 else 3), y / ax, z / ax
+    if ay >= az:
+        return (1 if y > 0 else 4), x / ay, z / ay
+    return (2 if z > 0 else 5), x / az, y / az
+
+
+def _face_dirs(face, u, v):
+    """Inverse of _face_coords, works on arrays of u and v."""
+    one = np.ones_like(u) * (1 if face < 3 else -1)
+    axis = face % 3
+    if axis == 0:
+        return np.stack([one, u, v], axis=-1)
+    if axis == 1:
+        return np.stack([u, one, v], axis=-1)
+    return np.stack([u, v, one], axis=-1)
+
+
+class SphereIndex:
+    """
+    Buckets objects on the unit sphere by projecting them onto the faces of a
+    cube, the same way the PlanetSide grids are laid out, with each face split
+    up into resolution x resolution buckets.  Every bucket is bounded by a
+    spherical cap, which lets queries skip whole buckets at once.
+    """
+    def __init__(self, resolution=8):
+        self.resolution = resolution
+
+        edges = np.linspace(-1, 1, resolution + 1)
+        mids = (edges[:-1] + edges[1:]) / 2
+        centers = []
+        radii = []
+        for face in range(6):
+            u, v = np.meshgrid(mids, mids, indexing='ij')
+            center = _face_dirs(face, u, v)
+            center /= np.linalg.norm(center, axis=-1, keepdims=True)
+            max_angle = np.zeros(u.shape)
+            for du in (0, 1):
+                for dv in (0, 1):
+                    cu, cv = np.meshgrid(edges[du:resolution + du], edges[dv:resolution + dv], indexing='ij')
+                    corner = _face_dirs(face, cu, cv)
+                    corner /= np.linalg.norm(corner, axis=-1, keepdims=True)
+                    dots = np.clip(np.sum(corner * center, axis=-1), -1, 1)
+                    max_angle = np.maximum(max_angle, np.arccos(dots))
+            centers.append(center.reshape(-1, 3))
+            radii.append(max_angle.reshape(-1))
+        self._centers = np.concatenate(centers)
+        self._radii = np.concatenate(radii)
+
+        self._buckets = [{} for _ in range(len(self._radii))]
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, obj):
+        return obj in self._entries
+
+    def _bucket(self, x, y, z):
+        face, u, v = _face_coords(x, y, z)
+        res = self.resolution
+        i = min(int((u + 1) * 0.5 * res), res - 1)
+        j = min(int((v + 1) * 0.5 * res), res - 1)
+        return (face * res + i) * res + j
+
+    def insert(self, obj, pos):
+        """Adds the object at the given position, which is normalized.  If the
+        object is already in the index, it is moved instead."""
+        pos = _normalized(pos)
+        bucket = self._bucket(*pos)
+        prev_bucket = self._entries.get(obj)
+        if prev_bucket is not None and prev_bucket != bucket:
+            del self._buckets[prev_bucket][obj]
+        self._buckets[bucket][obj] = pos
+        self._entries[obj] = bucket
+
+    move = insert
+
+    def remove(self, obj):
+        bucket = self._entries.pop(obj, None)
+        if bucket is not None:
+            del self._buckets[bucket][obj]
+
+    def get_pos(self, obj):
+        return self._buckets[self._entries[obj]][obj]
+
+    def _bucket_angles(self, pos):
+        dots = np.clip(self._centers @ np.asarray(pos), -1, 1)
+        return np.arccos(dots) - self._radii
+
+    def within_angle(self, pos, angle, predicate=None):
+        """Returns (obj, angle) pairs for all objects within a cone of the given
+        angle (in radians) around pos, sorted from nearest to farthest."""
+        pos = _normalized(pos)
+        px, py, pz = pos
+        min_dot = math.cos(angle)
+        result = []
+        for bucket in np.flatnonzero(self._bucket_angles(pos) <= angle):
+            for obj, (x, y, z) in self._buckets[bucket].items():
+                dot = px * x + py * y + pz * z
+                if dot >= min_dot and (predicate is None or predicate(obj)):
+                    result.append((obj, math.acos(min(dot, 1.0))))
+        result.sort(key=lambda i: i[1])
+        return result
+
+    def within_distance(self, pos, distance, predicate=None):
+        """Like within_angle, but takes a straight-line distance on the unit
+        sphere instead of an angle."""
+        if distance >= 2:
+            angle = math.pi
+        else:
+            angle = 2 * math.asin(distance / 2)
+        return self.within_angle(pos, angle, predicate)
+
+    def nearest(self, pos, max_angle=math.pi, predicate=None):
+        """Returns the object closest to pos for which the predicate holds, or
+        None if there is none within max_angle (in radians)."""
+        pos = _normalized(pos)
+        px, py, pz = pos
+        lower = self._bucket_angles(pos)
+
+        best = None
+        best_angle = max_angle
+        best_dot = math.cos(max_angle)
+        for bucket in np.argsort(lower):
+            if lower[bucket] > best_angle:
+                break
+            for obj, (x, y, z) in self._buckets[bucket].items():
+                dot = px * x + py * y + pz * z
+                if dot > best_dot and (predicate is None or predicate(obj)):
+                    best = obj
+                    best_dot = dot
+                    best_angle = math.acos(min(dot, 1.0))
+        return best
+
+
+class UniformGrid:
+    """
+    A spatial hash of points in 3D space, bucketed into cubic cells of a fixed
+    size.  It is meant for points that all move every frame, so rather than
+    moving entries around, the whole grid is rebuilt from an array of points
+    with build().
+    """
+    # Cell coordinates are packed into a single integer key
+    _BITS = 21
+    _OFFSET = 1 << (_BITS - 1)
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.positions = np.zeros((0, 3))
+        self._order = np.zeros(0, dtype=np.int64)
+        self._keys = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _pack(self, cells):
+        cells = cells + self._OFFSET
+        return (cells[..., 0] << (2 * self._BITS)) | (cells[..., 1] << self._BITS) | cells[..., 2]
+
+    def build(self, positions):
+        """Replaces the contents of the grid with the given (N, 3) array of
+        points, which are afterwards referred to by their index."""
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+        cells = np.floor(self.positions / self.cell_size).astype(np.int64)
+        keys = self._pack(cells)
+        self._order = np.argsort(keys, kind='stable')
+        self._keys = keys[self._order]
+
+    def query(self, center, radius):
+        """Returns the indices of the points that lie in any cell overlapping
+        the sphere with the given center and radius.  These are candidates
+        only, the caller still needs to test the actual distances."""
+        if not len(self._keys):
+            return self._order
+        center = np.asarray(center, dtype=float)
+        low = np.floor((center - radius) / self.cell_size).astype(np.int64)
+        high = np.floor((center + radius) / self.cell_size).astype(np.int64)
+        cells = np.stack(np.meshgrid(
+            np.arange(low[0], high[0] + 1),
+            np.arange(low[1], high[1] + 1),
+            np.arange(low[2], high[2] + 1),
+            indexing='ij',
+        ), axis=-1).reshape(-1, 3)
+        keys = self._pack(cells)
+        starts = np.searchsorted(self._keys, keys, side='left')
+        ends = np.searchsorted(self._keys, keys, side='right')
+        slices = [self._order[start:end] for start, end in zip(starts.tolist(), ends.tolist()) if end > start]
+        if not slices:
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate(slices)
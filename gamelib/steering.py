@@ -0,0 +1,66 @@
+"""
+Steering of objects that walk over the planet surface.  Positions are
+directions on the unit sphere, relative to the planet root.
+"""
+
+import math
+
+from panda3d import core
+
+
+class Steering:
+    """
+    Moves a PlanetObject along the great circle toward a target, and works
+    out which way it needs to face to get there.  Everything is computed from
+    the orientation of the object's pivot, and the vectors it passes on are
+    reused, so that walking does not need any throwaway nodes.
+    """
+    def __init__(self, walker):
+        self.walker = walker
+        self._pos = core.Vec3()
+        self._up = core.Vec3()
+
+    def heading_to(self, target):
+        """Returns the heading (in degrees, relative to the walker's root)
+        that faces the given target, or None if the walker is right on it."""
+        quat = self.walker.pivot.get_quat()
+        x = -target.dot(quat.get_right())
+        y = -target.dot(quat.get_up())
+        if x * x + y * y < 1e-12:
+            return None
+        return math.degrees(math.atan2(x, y))
+
+    def angle_to(self, target):
+        """Returns the angle (in radians) between the walker and the target."""
+        pos = self.walker.pivot.get_quat().get_forward()
+        return math.acos(max(-1.0, min(1.0, pos.dot(target))))
+
+    def step_toward(self, target, max_angle):
+        """Moves the walker toward the given normalized target, by at most the
+        given angle (in radians).  Returns True if it arrived."""
+        quat = self.walker.pivot.get_quat()
+        pos = quat.get_forward()
+        up = quat.get_up()
+        angle = math.acos(max(-1.0, min(1.0, pos.dot(target))))
+
+        if angle <= max_angle:
+            self._pos.set(target.x, target.y, target.z)
+            arrived = True
+        else:
+            sin_angle = math.sin(angle)
+            if sin_angle < 1e-6:
+                # Right on the other side of the planet, every great circle
+                # leads there, so just walk straight ahead
+                a = math.cos(max_angle)
+                b = math.sin(max_angle)
+                self._pos.set(pos.x * a - up.x * b, pos.y * a - up.y * b, pos.z * a - up.z * b)
+            else:
+                # Spherical interpolation along the great circle
+                a = math.sin(angle - max_angle) / sin_angle
+                b = math.sin(max_angle) / sin_angle
+                self._pos.set(pos.x * a + target.x * b, pos.y * a + target.y * b, pos.z * a + target.z * b)
+            arrived = False
+
+        self._up.set(up.x, up.y, up.z)
+        self.walker.set_pos_up(self._pos, self._up)
+        return arrived
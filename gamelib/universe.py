@@ -7,7 +7,12 @@ from direct.interval.IntervalGlobal import *
 from direct.fsm.FSM import FSM
 
 from .planet import Planet
-from .asteroid import Asteroid
+from .asteroid import Asteroid, AsteroidField, AsteroidPool, SpawnScheduler
+from .massivefield import MassiveAsteroidField
+from .renderer import SHADOW_CAMERA_MASK
+from .quality import QUALITY_CHANGED_EVENT
+from .settings import settings
+from .shadows import ShadowFitter
 from .skybox import Skybox
 from .playercontrol import PlayerControl
 from .gamelogic import GameLogic
@@ -16,7 +21,6 @@ from .cutscene import EndingCutscene
 
 
 MAX_ASTEROIDS = [6, 12, 18, 24, 30]
-SPAWN_TIME = 1.5
 
 INSTRUCTIONS = """
 Reach for the stars Obbo!
@@ -43,28 +47,48 @@ class Universe(FSM, DirectObject):
         self.planet = Planet()
         self.planet.super_root.reparent_to(self.root)
         self.player_control = PlayerControl(self)
-        self.planet_size = self.planet.size
 
         self.dlight = core.DirectionalLight("light")
         self.dlight.color = (0.5, 0.5, 0.5, 1)
         self.dlight.set_shadow_caster(True, 1024, 1024)
-        dlight_lens = self.dlight.get_lens()
-        dlight_lens.set_film_size(-3, 3)
-        dlight_lens.set_near_far(-4, 1)
+        self.dlight.set_camera_mask(SHADOW_CAMERA_MASK)
         dlight_path = self.planet.root.attach_new_node(self.dlight)
         dlight_path.look_at((1, 1, 0))
         self.root.set_light(dlight_path)
+        base.render_pipeline.register_caster(dlight_path)
+        self.shadow_fitter = ShadowFitter(dlight_path, self.planet, self.player_control.player)
+        self.shadow_fitter.update()
         #self.dlight.show_frustum()
 
         self.alight = core.AmbientLight("light")
         self.alight.color = (0.5, 0.5, 0.5, 1)
         self.root.set_light(self.root.attach_new_node(self.alight))
 
-        self.asteroids = [Asteroid(self.planet, self) for _ in range(6)]
-        self.last_asteroid = 0
+        self.asteroid_field = AsteroidField(self.planet)
+        self.asteroid_pool = AsteroidPool(self.planet, self, MAX_ASTEROIDS[-1])
+
+        # Profiling runs always use the same asteroids, so they can be compared
+        seed = settings.asteroid_seed
+        if settings.profile_mode:
+            seed = 0
+        elif seed < 0:
+            seed = random.randrange(2 ** 32)
+        self.spawn_scheduler = SpawnScheduler(seed, len(Asteroid.MESHES))
+
+        # In the massive mode, the asteroids in orbit all live in one big
+        # instanced field, and only the caught ones become real asteroids
+        if settings.asteroid_field_mode == 'massive':
+            count = settings.asteroid_field_count
+            self.massive_field = MassiveAsteroidField(self.planet, self.asteroid_pool, count, seed)
+            self.asteroids = []
+        else:
+            self.massive_field = None
+            self.asteroids = [
+                self.asteroid_pool.acquire(self.spawn_scheduler.take_plan())
+                for _ in range(MAX_ASTEROIDS[0])
+            ]
 
-        skip_main_menu = panda3d.core.ConfigVariableBool('skip-main-menu', False).get_value()
-        if skip_main_menu:
+        if settings.skip_main_menu:
             # If we skipped the main menu, do not show the instructions
             self.instructions = None
         else:
@@ -77,19 +101,32 @@ class Universe(FSM, DirectObject):
             'remove insntructions'
         )
 
+        self.apply_quality(base.quality.tier)
+        self.accept(QUALITY_CHANGED_EVENT, self.apply_quality)
+
         self.accept('display_msg', self.display_message)
         self.request('Universe')
         self.accept('beacon_built', self.handle_victory)
-        if core.ConfigVariableBool('enable-cheats').get_value():
+        if settings.enable_cheats:
             self.accept('f11', self.handle_victory)
 
     def cleanup(self):
         self.root.remove_node()
+        self.planet.cleanup()
+        if self.massive_field is not None:
+            self.massive_field.cleanup()
         self.hud.cleanup()
         self.player_control.cleanup()
         base.render.clear_light()
         self.ignore_all()
 
+    def apply_quality(self, tier):
+        self.shadow_fitter.set_max_size(min(tier.shadow_map_size, settings.shadow_map_max_size))
+        self.planet.set_prop_density(tier.prop_density)
+        self.asteroid_density = tier.asteroid_density
+        if self.massive_field is not None:
+            self.massive_field.density = tier.asteroid_density
+
     def display_message(self, text, duration=INSTRUCTIONS_AUTO_REMOVE_TIME):
         self.add_instructions(text)
         taskMgr.do_method_later(
@@ -120,7 +157,7 @@ class Universe(FSM, DirectObject):
             return task.done
 
     def handle_victory(self):
-        self.planet.root.set_scale(1 + 5 ** 1.5)
+        self.planet.set_radius(1 + 5 ** 1.5)
         self.player_control.universe.hud.hide()
         self.player_control.player.root.hide()
         self.player_control.ignore('space')
@@ -132,6 +169,8 @@ class Universe(FSM, DirectObject):
             asteroid.destroy()
 
         self.asteroids.clear()
+        if self.massive_field is not None:
+            self.massive_field.clear()
 
         # Hide building icons
         for side in self.planet.sides:
@@ -150,14 +189,35 @@ class Universe(FSM, DirectObject):
         base.transitions.fadeOut()
         self.player_control.exit()
 
+    def find_asteroids(self, centers, radius):
+        """Returns the asteroids touching any of the spheres with the given
+        centers (relative to the planet root) and radius, nearest first.  In
+        the massive mode, only the nearest asteroid is returned."""
+        if self.massive_field is None:
+            return self.asteroid_field.hit_test(centers, radius)
+
+        indices, _ = self.massive_field.hit_test(centers, radius)
+        if not indices:
+            return []
+        asteroid = self.massive_field.promote(indices[0])
+        self.asteroids.append(asteroid)
+        return [asteroid]
+
     def update(self, dt):
+        self.asteroid_field.update(dt)
+        mx_asteroids = MAX_ASTEROIDS[min(self.planet.size, len(MAX_ASTEROIDS)) - 1]
+        if self.massive_field is not None:
+            # The field grows along with the planet, like the normal one
+            field = self.massive_field
+            field.target_count = int(field.count * field.density) * mx_asteroids // MAX_ASTEROIDS[-1]
+            field.update(dt)
+            mx_asteroids = 0
+        else:
+            # Asteroids that are already there stay, there just will not be
+            # new ones until the count has dropped below the lower cap
+            mx_asteroids = max(1, int(mx_asteroids * self.asteroid_density))
         self.player_control.update(dt)
-        ft = globalClock.get_frame_time()
-        mx_asteroids = MAX_ASTEROIDS[self.planet.size - 1]
-        if ft > self.last_asteroid + SPAWN_TIME and len(self.asteroids) < mx_asteroids:
-            self.last_asteroid = ft
-            self.asteroids.append(Asteroid(self.planet, self))
-        if self.planet_size != self.planet.size:
-            self.planet_size = self.planet.size
-            for i in self.asteroids:
-                i.update_pos()
+        self.shadow_fitter.update()
+        plan = self.spawn_scheduler.update(dt, len(self.asteroids), mx_asteroids)
+        if plan is not None:
+            self.asteroids.append(self.asteroid_pool.acquire(plan))
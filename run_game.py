@@ -8,6 +8,8 @@ import pman
 import pman.shim
 
 from gamelib import renderer
+from gamelib.quality import QualityGovernor, TIERS as QUALITY_TIERS
+from gamelib.settings import settings, SETTINGS_CHANGED_EVENT
 from gamelib.util import srgb_color
 
 # States
@@ -27,30 +29,32 @@ GAME_STATES = {
 }
 
 
-panda3d.core.load_prc_file(
-    panda3d.core.Filename.expand_from('$MAIN_DIR/settings.prc')
-)
-
-USER_CONFIG_PATH = panda3d.core.Filename.expand_from(
-    '$MAIN_DIR/user.prc'
-)
-if USER_CONFIG_PATH.exists():
-    panda3d.core.load_prc_file(USER_CONFIG_PATH)
+settings.load()
 
 
 class GameApp(ShowBase):
     def __init__(self):
         ShowBase.__init__(self)
         pman.shim.init(self)
-        potato_mode = panda3d.core.ConfigVariableBool('potato-mode', False).get_value()
         self.set_background_color(srgb_color(0x292931))
         self.luttex = self.load_lut('lut.png')
         self.render_pipeline = renderer.Pipeline(
             lut_texture=self.luttex,
+            dynamic_resolution=settings.dynamic_resolution,
+            target_fps=settings.target_fps,
+            min_render_scale=settings.min_render_scale,
+        )
+        # Profiling runs need to stay comparable, so the quality must not
+        # change based on how fast they happen to run
+        self.quality = QualityGovernor(
+            self.render_pipeline,
+            target_fps=settings.target_fps,
+            enabled=settings.quality_governor and not settings.profile_mode,
         )
-        self.set_graphics_quality(potato_mode)
+        self.set_graphics_quality(settings.potato_mode)
+        self.accept(SETTINGS_CHANGED_EVENT, self.apply_setting)
 
-        if panda3d.core.ConfigVariableBool('esc-to-exit', False).get_value():
+        if settings.esc_to_exit:
             self.accept('escape', sys.exit)
 
         self.render.set_shader_inputs(uv_shift=(0.0, 0.0))
@@ -59,24 +63,22 @@ class GameApp(ShowBase):
 
         # Get volume levels from config
         self.musicManager.set_volume(
-            panda3d.core.ConfigVariableDouble('audio-music-volume', 1.0).get_value()
+            settings.audio_music_volume
         )
         self.sfxManagerList[0].set_volume(
-            panda3d.core.ConfigVariableDouble('audio-sfx-volume', 1.0).get_value()
+            settings.audio_sfx_volume
         )
 
         self.bgm_name = None
 
         self.transitions.fadeScreen(1.0)
 
-        profile_mode = panda3d.core.ConfigVariableBool('profile-mode', False).get_value()
-        if profile_mode:
+        if settings.profile_mode:
             import random
             random.seed(0)
 
-        skip_main_menu = panda3d.core.ConfigVariableBool('skip-main-menu', False).get_value()
         self.gamestate = None
-        if skip_main_menu:
+        if settings.skip_main_menu:
             self.change_state('Universe')
         else:
             self.change_state('MainMenu')
@@ -106,8 +108,14 @@ class GameApp(ShowBase):
         self.task_mgr.add(self.__update)
 
     def set_graphics_quality(self, is_low):
-        rpipe = self.render_pipeline
-        rpipe.enable_shadows = not is_low
+        # Potato mode sticks to the lowest tier
+        self.quality.pin(len(QUALITY_TIERS) - 1 if is_low else None)
+
+    def apply_setting(self, name, value):
+        if name == 'potato_mode':
+            self.set_graphics_quality(value)
+        elif name == 'dynamic_resolution':
+            self.render_pipeline.dynamic_resolution = value
 
     def refresh(self):
         import limeade
@@ -2,6 +2,10 @@
 
 #define MAX_LIGHTS 1
 
+#ifdef INSTANCED
+#extension GL_ARB_draw_instanced : require
+#endif
+
 #ifdef ENABLE_SHADOWS
 uniform struct p3d_LightSourceParameters {
     vec4 position;
@@ -17,6 +21,13 @@ uniform struct p3d_LightSourceParameters {
 uniform float osg_FrameTime;
 
 uniform bool is_planet_prop;
+uniform bool is_build_sign;
+uniform float anim_phase;
+
+// Build signs spin around and bob up and down once per period
+const float SIGN_ANIM_PERIOD = 1.5;
+const float SIGN_BOB_HEIGHT = 0.25;
+const float TWO_PI = 6.283185307179586;
 
 uniform mat4 p3d_ProjectionMatrix;
 uniform mat4 p3d_ModelViewMatrix;
@@ -30,6 +41,21 @@ attribute vec2 p3d_MultiTexCoord0;
 
 uniform vec2 uv_shift;
 
+#ifdef INSTANCED
+// Every instance takes up two texels in a row of the instance data texture:
+// the position and scale, followed by the spin axis and angle
+const float INSTANCES_PER_ROW = 256.0;
+uniform sampler2D instance_data;
+uniform float instance_rows;
+
+vec3 rotate(vec3 v, vec4 axis_angle) {
+    vec3 axis = axis_angle.xyz;
+    float c = cos(axis_angle.w);
+    float s = sin(axis_angle.w);
+    return v * c + cross(axis, v) * s + axis * dot(axis, v) * (1.0 - c);
+}
+#endif
+
 
 varying vec3 v_position;
 varying vec4 v_color;
@@ -45,10 +71,28 @@ void main() {
         model_pos.xyz *= 1.0 + sin(osg_FrameTime * 3.0) / 60.0;
         model_pos.x += sin(osg_FrameTime * 1.5) * abs(model_pos.z * model_pos.z) / 15.0;
     }
+    vec3 model_normal = p3d_Normal;
+#ifdef INSTANCED
+    float instance = float(gl_InstanceIDARB);
+    float row = floor(instance / INSTANCES_PER_ROW);
+    float column = instance - row * INSTANCES_PER_ROW;
+    float v = (row + 0.5) / instance_rows;
+    vec4 placement = texture2DLod(instance_data, vec2((column * 2.0 + 0.5) / (INSTANCES_PER_ROW * 2.0), v), 0.0);
+    vec4 spin = texture2DLod(instance_data, vec2((column * 2.0 + 1.5) / (INSTANCES_PER_ROW * 2.0), v), 0.0);
+    model_pos.xyz = rotate(model_pos.xyz, spin) * placement.w + placement.xyz;
+    model_normal = rotate(model_normal, spin);
+#endif
+    if (is_build_sign) {
+        float angle = fract(osg_FrameTime / SIGN_ANIM_PERIOD + anim_phase) * TWO_PI;
+        mat2 spin = mat2(cos(angle), sin(angle), -sin(angle), cos(angle));
+        model_pos.xy = spin * model_pos.xy;
+        model_normal.xy = spin * model_normal.xy;
+        model_pos.z += SIGN_BOB_HEIGHT * (0.5 - 0.5 * cos(angle));
+    }
     vec4 vert_pos4 = p3d_ModelViewMatrix * model_pos;
     v_position = vec3(vert_pos4);
     v_color = p3d_Color;
-    v_normal = normalize(p3d_NormalMatrix * p3d_Normal);
+    v_normal = normalize(p3d_NormalMatrix * model_normal);
     v_texcoord = p3d_MultiTexCoord0 + uv_shift;
 #ifdef ENABLE_SHADOWS
     v_shadow_pos[0] = p3d_LightSource[0].shadowViewMatrix * vert_pos4;
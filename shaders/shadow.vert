@@ -2,6 +2,16 @@
 
 uniform mat4 p3d_ModelViewProjectionMatrix;
 
+uniform float osg_FrameTime;
+
+uniform bool is_build_sign;
+uniform float anim_phase;
+
+// Must match the build sign animation in pbr.vert
+const float SIGN_ANIM_PERIOD = 1.5;
+const float SIGN_BOB_HEIGHT = 0.25;
+const float TWO_PI = 6.283185307179586;
+
 attribute vec4 p3d_Vertex;
 attribute vec4 p3d_Color;
 attribute vec2 p3d_MultiTexCoord0;
@@ -11,7 +21,14 @@ varying vec4 v_color;
 varying vec2 v_texcoord;
 
 void main() {
+    vec4 model_pos = p3d_Vertex;
+    if (is_build_sign) {
+        float angle = fract(osg_FrameTime / SIGN_ANIM_PERIOD + anim_phase) * TWO_PI;
+        mat2 spin = mat2(cos(angle), sin(angle), -sin(angle), cos(angle));
+        model_pos.xy = spin * model_pos.xy;
+        model_pos.z += SIGN_BOB_HEIGHT * (0.5 - 0.5 * cos(angle));
+    }
     v_color = p3d_Color;
     v_texcoord = p3d_MultiTexCoord0;
-    gl_Position = p3d_ModelViewProjectionMatrix * p3d_Vertex;
+    gl_Position = p3d_ModelViewProjectionMatrix * model_pos;
 }